@@ -0,0 +1,86 @@
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram.fsm.storage.base import StorageKey  # noqa: E402
+
+from db import Database, migrate  # noqa: E402
+from fsm_storage import create_storage  # noqa: E402
+from resp_server import RespServer  # noqa: E402
+
+# Накладные расходы хранилища FSM на одно обновление.
+# Одно «обновление» повторяет то, что делают aiogram и наши обработчики
+# на шаге диалога: get_state (middleware) + update_data + set_state (обработчик).
+#
+#   python benchmarks/fsm_storage_bench.py --updates 5000 --users 200
+#   python benchmarks/fsm_storage_bench.py --redis-url redis://localhost:6379/0
+#
+# Без --redis-url вариант redis гоняется против встроенного RESP-сервера
+# (resp_server.py) — это проверка совместимости, а не скорость настоящего Redis.
+
+
+async def run_updates(storage, updates: int, users: int, concurrency: int):
+    latencies = []
+    queue = asyncio.Queue()
+    for i in range(updates):
+        queue.put_nowait(i)
+
+    async def worker():
+        while not queue.empty():
+            i = queue.get_nowait()
+            key = StorageKey(bot_id=1, chat_id=i % users, user_id=i % users)
+            started = time.perf_counter()
+            await storage.get_state(key)
+            await storage.update_data(key, {"step": i, "weight": 70})
+            await storage.set_state(key, f"ProfileSetup:step{i % 5}")
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "updates_per_sec": updates / elapsed,
+        "mean_us": statistics.mean(latencies) * 1e6,
+        "p99_us": latencies[int(len(latencies) * 0.99) - 1] * 1e6,
+    }
+
+
+async def main(args):
+    kinds = ["memory", "sqlite", "redis"]
+    stand_in = None
+    if not args.redis_url:
+        stand_in = await RespServer().start()
+        args.redis_url = stand_in.url
+    with tempfile.TemporaryDirectory() as tmp:
+        database = Database(os.path.join(tmp, "bench.db"))
+        await database.open()
+        async with database.write() as db:
+            await migrate(db)
+
+        print(f"{'хранилище':<10} {'обн/с':>10} {'среднее, мкс':>14} {'p99, мкс':>10}")
+        for kind in kinds:
+            storage = create_storage(kind, database, redis_url=args.redis_url)
+            result = await run_updates(storage, args.updates, args.users, args.concurrency)
+            await storage.close()
+            print(f"{kind:<10} {result['updates_per_sec']:>10.0f} {result['mean_us']:>14.0f} {result['p99_us']:>10.0f}")
+
+        await database.close()
+    if stand_in is not None:
+        await stand_in.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарк хранилищ FSM")
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--redis-url", help="адрес Redis-совместимого сервера; без него — встроенный resp_server.py")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,389 @@
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+from aiogram.client.session.base import BaseSession  # noqa: E402
+from aiogram.types import CallbackQuery, Chat, Message, PhotoSize, Update, User  # noqa: E402
+
+# Нагрузочный тест бота целиком: синтетические Update подаются в dp.feed_update,
+# как их подавал бы polling или webhook. Telegram заменён заглушкой сессии бота,
+# OpenWeatherMap и OpenFoodFacts — локальными HTTP-заглушками в отдельном потоке.
+# База, пул графиков, групповая запись логов и хранилище FSM — настоящие.
+#
+#   python benchmarks/load_bench.py --updates 5000 --concurrency 50 --db-users 10000 --db-days 90
+#   python benchmarks/load_bench.py --compare benchmarks/results/load_bench-20250301-120000.json
+#
+# Задержка одного обновления — время dp.feed_update (включая ответы в заглушку Telegram).
+# Лаг event loop — насколько позже запланированного просыпается задача с sleep(--lag-interval).
+
+SCENARIOS = {
+    # сценарий: (вес в смеси, шаги)
+    "water": (35, ["/log_water", "{water}"]),
+    "food": (25, ["/log_food", "{food}", "{grams}"]),
+    "workout": (15, ["/log_workout", "cb:workout:{workout}", "{minutes}"]),
+    "progress": (20, ["/check_progress", "cb:progress:{today}"]),
+    "profile": (5, ["/set_profile", "{weight}", "{height}", "{age}", "{activity}", "{city}"]),
+}
+
+FOODS = ["гречка", "яблоко", "банан", "овсянка", "творог", "курица", "рис", "кефир", "хлеб", "сыр", "йогурт", "омлет"]
+CITIES = ["Москва", "Санкт-Петербург", "Казань", "Новосибирск", "Сочи", "Мурманск"]
+WORKOUTS = ["cardio", "strength", "other"]
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
+
+
+def summarize(latencies):
+    values = sorted(latencies)
+    return {
+        "count": len(values),
+        "mean_ms": statistics.mean(values) * 1000 if values else 0.0,
+        "p50_ms": percentile(values, 50) * 1000,
+        "p95_ms": percentile(values, 95) * 1000,
+        "p99_ms": percentile(values, 99) * 1000,
+        "max_ms": (values[-1] if values else 0.0) * 1000,
+    }
+
+
+# Заглушки внешних API: живут в своём потоке и своём event loop, чтобы не нагружать измеряемый
+def start_stub_servers(latency: float):
+    from aiohttp import web
+
+    async def weather(request):
+        await asyncio.sleep(latency)
+        city = request.query.get("q", "")
+        return web.json_response({"name": city, "main": {"temp": 10 + len(city) % 20}})
+
+    async def food(request):
+        await asyncio.sleep(latency)
+        term = request.query.get("search_terms", "")
+        return web.json_response({"products": [
+            {"product_name": term, "nutriments": {"energy-kcal_100g": 50 + len(term) * 17 % 300}}
+        ]})
+
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+    state = {}
+
+    async def serve():
+        app = web.Application()
+        app.router.add_get("/data/2.5/weather", weather)
+        app.router.add_get("/cgi/search.pl", food)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        state["runner"] = runner
+        state["port"] = site._server.sockets[0].getsockname()[1]
+        ready.set()
+
+    def run():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(serve())
+        loop.run_forever()
+        loop.run_until_complete(state["runner"].cleanup())
+        loop.close()
+
+    thread = threading.Thread(target=run, name="stub-servers", daemon=True)
+    thread.start()
+    ready.wait()
+
+    def stop():
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+
+    return f"http://127.0.0.1:{state['port']}", stop
+
+
+# Заглушка Telegram: отвечает на методы без сети, с необязательной задержкой «сети»
+class StubSession(BaseSession):
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.requests = 0
+        self._message_ids = itertools.count(1)
+
+    async def make_request(self, bot, method, timeout=None):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method.__returning__ is User:
+            return User(id=bot.id, is_bot=True, first_name="Bench", username="bench_bot")
+        if method.__returning__ is not Message:
+            return True
+        message_id = next(self._message_ids)
+        photo = None
+        if type(method).__name__ == "SendPhoto":
+            photo = [PhotoSize(file_id=f"photo{message_id}", file_unique_id=f"u{message_id}", width=600, height=400)]
+        return Message(
+            message_id=message_id,
+            date=datetime.now(),
+            chat=Chat(id=method.chat_id, type="private"),
+            text=getattr(method, "text", None),
+            photo=photo,
+        )
+
+    async def stream_content(self, *args, **kwargs):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class UpdateFactory:
+    def __init__(self):
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    def _message(self, user_id: int, text=None):
+        return Message(
+            message_id=next(self._message_ids),
+            date=datetime.now(),
+            chat=Chat(id=user_id, type="private"),
+            from_user=User(id=user_id, is_bot=False, first_name="Load"),
+            text=text,
+        )
+
+    def build(self, user_id: int, step: str) -> Update:
+        if step.startswith("cb:"):
+            return Update(update_id=next(self._update_ids), callback_query=CallbackQuery(
+                id=str(next(self._message_ids)),
+                from_user=User(id=user_id, is_bot=False, first_name="Load"),
+                chat_instance=str(user_id),
+                data=step[3:],
+                message=self._message(user_id, "кнопка"),
+            ))
+        return Update(update_id=next(self._update_ids), message=self._message(user_id, step))
+
+
+def render_step(step: str, rng: random.Random) -> str:
+    return step.format(
+        water=rng.choice([150, 200, 250, 330, 500]),
+        food=rng.choice(FOODS),
+        grams=rng.randint(50, 400),
+        workout=rng.choice(WORKOUTS),
+        minutes=rng.randint(10, 90),
+        today=datetime.now().strftime("%d-%m-%Y"),
+        weight=rng.randint(50, 110),
+        height=rng.randint(150, 200),
+        age=rng.randint(18, 70),
+        activity=rng.choice([0, 30, 60, 90, 150, 200]),
+        city=rng.choice(CITIES),
+    )
+
+
+async def populate(bot2, users: int, days: int, seed: int):
+    rng = random.Random(seed)
+    today = datetime.now(bot2.LOCAL_TZ)
+    async with bot2.db_pool.write() as db:
+        await db.executemany(
+            "INSERT OR REPLACE INTO users (user_id, weight, height, age, activity, city, calorie_goal, water_goal) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (user_id, rng.randint(50, 110), rng.randint(150, 200), rng.randint(18, 70), 60,
+                 rng.choice(CITIES), rng.randint(1800, 3200), rng.randint(1500, 3500))
+                for user_id in range(1, users + 1)
+            ],
+        )
+    for offset in range(days):
+        d = today - timedelta(days=offset)
+        day, date = bot2.day_key(d), d.strftime("%Y-%m-%d")
+        # один день — одна транзакция, чтобы не держать писателя минутами
+        async with bot2.db_pool.write() as db:
+            await db.executemany(
+                "INSERT INTO water_logs (user_id, date, day, amount) VALUES (?, ?, ?, ?)",
+                [(user_id, date, day, rng.choice([250, 500])) for user_id in range(1, users + 1)],
+            )
+            await db.executemany(
+                "INSERT INTO food_logs (user_id, date, day, food_name, calories) VALUES (?, ?, ?, ?, ?)",
+                [(user_id, date, day, rng.choice(FOODS), rng.uniform(100, 900)) for user_id in range(1, users + 1)],
+            )
+            await db.executemany(
+                "INSERT INTO workout_logs (user_id, date, day, workout_type, duration, calories_burned) VALUES (?, ?, ?, ?, ?, ?)",
+                [(user_id, date, day, "Кардио тренировка 🏃", 30, 300) for user_id in range(1, users + 1) if rng.random() < 0.3],
+            )
+
+
+async def measure_loop_lag(interval: float, samples: list, stop: asyncio.Event):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, time.perf_counter() - started - interval))
+
+
+async def run_load(bot2, args):
+    factory = UpdateFactory()
+    weights = [weight for weight, _ in SCENARIOS.values()]
+    names = list(SCENARIOS)
+    latencies = {name: [] for name in names}
+    remaining = itertools.count()
+    errors = 0
+
+    async def virtual_user(index: int):
+        nonlocal errors
+        rng = random.Random(args.seed + index)
+        # у каждого виртуального пользователя свои user_id, чтобы диалоги FSM не пересекались
+        user_ids = range(index + 1, args.db_users + 1, args.concurrency) or [index + 1]
+        while next(remaining) < args.updates:
+            scenario = rng.choices(names, weights)[0]
+            user_id = rng.choice(user_ids)
+            for step in SCENARIOS[scenario][1]:
+                update = factory.build(user_id, render_step(step, rng))
+                started = time.perf_counter()
+                try:
+                    await bot2.dp.feed_update(bot2.bot, update)
+                except Exception:
+                    errors += 1
+                latencies[scenario].append(time.perf_counter() - started)
+
+    lag_samples = []
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(measure_loop_lag(args.lag_interval, lag_samples, stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(virtual_user(i) for i in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await lag_task
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    return {
+        "elapsed_s": elapsed,
+        "updates": len(all_latencies),
+        "updates_per_sec": len(all_latencies) / elapsed,
+        "errors": errors,
+        "latency": summarize(all_latencies),
+        "scenarios": {name: summarize(values) for name, values in latencies.items() if values},
+        "loop_lag": summarize(lag_samples),
+    }
+
+
+async def main(args, output_path):
+    import bot2
+
+    # aiogram пишет строку на каждое обновление — в тесте это только шум
+    logging.getLogger().setLevel(logging.WARNING)
+
+    session = StubSession(args.telegram_latency / 1000)
+    bot2.bot.session = session
+    if args.telegram_limits:
+        session.middleware(bot2.delivery)
+
+    await bot2.db_pool.open()
+    await bot2.init_db()
+    await bot2.http_client.start()
+    bot2.chart_renderer.start()
+    bot2.log_writer.start()
+    try:
+        started = time.perf_counter()
+        await populate(bot2, args.db_users, args.db_days, args.seed)
+        print(f"База: {args.db_users} пользователей × {args.db_days} дней за {time.perf_counter() - started:.1f} с")
+
+        # прогрев: пул графиков, кэши погоды и каталога
+        await run_load(bot2, argparse.Namespace(**{**vars(args), "updates": args.concurrency}))
+        result = await run_load(bot2, args)
+    finally:
+        await bot2.log_writer.close()
+        await bot2.delivery.close()
+        bot2.chart_renderer.close()
+        await bot2.http_client.close()
+        await bot2.db_pool.close()
+
+    result["telegram_requests"] = session.requests
+    report = {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "config": vars(args),
+        "python": sys.version.split()[0],
+        "result": result,
+    }
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    return report
+
+
+def print_report(report, baseline=None):
+    result = report["result"]
+    base = baseline["result"] if baseline else None
+
+    def delta(value, key, sub=None):
+        if base is None:
+            return ""
+        old = base[key] if sub is None else base[key].get(sub)
+        if not old:
+            return ""
+        return f" ({(value - old) / old * 100:+.0f}%)"
+
+    print(f"Обновлений: {result['updates']} за {result['elapsed_s']:.1f} с, ошибок: {result['errors']}")
+    print(f"Пропускная способность: {result['updates_per_sec']:.0f} обн/с{delta(result['updates_per_sec'], 'updates_per_sec')}")
+    print(f"{'сценарий':<10} {'кол-во':>7} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9} {'max, мс':>9}")
+    rows = [("все", result["latency"])] + list(result["scenarios"].items())
+    for name, stats in rows:
+        print(f"{name:<10} {stats['count']:>7} {stats['p50_ms']:>9.1f} {stats['p95_ms']:>9.1f} {stats['p99_ms']:>9.1f} {stats['max_ms']:>9.1f}")
+    lag = result["loop_lag"]
+    print(f"Лаг event loop: p50 {lag['p50_ms']:.1f} мс, p99 {lag['p99_ms']:.1f} мс, max {lag['max_ms']:.1f} мс")
+    if base is not None:
+        print(f"p99 по всем: {result['latency']['p99_ms']:.1f} мс, было {base['latency']['p99_ms']:.1f} мс")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота через dp.feed_update")
+    parser.add_argument("--updates", type=int, default=2000, help="сколько сценариев прогнать (в каждом 2–6 обновлений)")
+    parser.add_argument("--concurrency", type=int, default=20, help="одновременных виртуальных пользователей")
+    parser.add_argument("--db-users", type=int, default=1000, help="пользователей с профилем в базе")
+    parser.add_argument("--db-days", type=int, default=30, help="дней истории логов на пользователя")
+    parser.add_argument("--fsm-storage", default="sqlite", choices=["memory", "sqlite", "redis"])
+    parser.add_argument("--redis-url")
+    parser.add_argument("--telegram-latency", type=float, default=0, help="задержка ответа заглушки Telegram, мс")
+    parser.add_argument("--telegram-limits", action="store_true", help="пропускать отправку через лимиты delivery")
+    parser.add_argument("--upstream-latency", type=float, default=50, help="задержка заглушек погоды и OpenFoodFacts, мс")
+    parser.add_argument("--lag-interval", type=float, default=0.01, help="период замера лага event loop, с")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="куда сохранить JSON (по умолчанию benchmarks/results/load_bench-<время>.json)")
+    parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    # результаты по умолчанию — в benchmarks/results (в .gitignore), а не в текущий каталог
+    output_path = os.path.abspath(args.output or os.path.join(
+        RESULTS_DIR, f"load_bench-{datetime.now():%Y%m%d-%H%M%S}.json"
+    ))
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    stub_url, stop_stubs = start_stub_servers(args.upstream_latency / 1000)
+    # bot2 читает настройки при импорте, а базу открывает в текущем каталоге
+    os.environ.setdefault("BOT_TOKEN", "123456:" + "A" * 35)
+    os.environ["OPENWEATHER_URL"] = stub_url + "/data/2.5/weather"
+    os.environ["OPENFOODFACTS_URL"] = stub_url + "/cgi/search.pl"
+    os.environ["FSM_STORAGE"] = args.fsm_storage
+    os.environ["SCHEDULER_ENABLED"] = "0"
+    if args.redis_url:
+        os.environ["REDIS_URL"] = args.redis_url
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            report = asyncio.run(main(args, output_path))
+        finally:
+            os.chdir(ROOT)
+            stop_stubs()
+
+    print_report(report, baseline)
+    print(f"Результаты сохранены в {output_path}")
@@ -0,0 +1,115 @@
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import Database, migrate  # noqa: E402
+from profiles import PROFILE_FIELDS, Profile, ProfileCache  # noqa: E402
+
+# Память на один закэшированный профиль и цена чтения норм с кэшем и без.
+# Память меряется tracemalloc'ом: кэш заполняется --profiles профилями так же,
+# как в боте (строки из базы), разница делится на число профилей. Для сравнения —
+# те же строки как tuple и как dict. Последний замер (Python 3.11, 64 бит):
+#   ProfileCache (Profile + LRU)   ~450 байт на профиль
+#   dict user_id -> tuple          ~320
+#   dict user_id -> dict           ~500
+# Сам Profile — 88 байт, остальное — значения полей (город, числа), пара
+# (срок жизни, профиль) и запись OrderedDict для LRU; 100 000 профилей
+# (размер кэша по умолчанию) — около 45 МБ.
+# Чтение норм из кэша ~1 мкс против ~80 мкс запросом к базе.
+#
+#   python benchmarks/profile_cache_bench.py --profiles 100000 --reads 20000
+
+CITIES = ["Москва", "Санкт-Петербург", "Казань", "Новосибирск", "Екатеринбург", "Сочи"]
+
+
+def random_row(user_id: int):
+    weight = random.randint(45, 130)
+    return (user_id, weight, random.randint(150, 200), random.randint(16, 80), random.choice([0, 30, 60, 90, 150]),
+            random.choice(CITIES), round(random.uniform(1500, 3500), 2), weight * 25)
+
+
+# строка, как её отдаёт sqlite: у каждой записи свои объекты чисел и строк
+# (кроме малых int, которые в CPython общие)
+def fetched(row):
+    user_id, weight, height, age, activity, city, calorie_goal, water_goal = row
+    return (int(str(user_id)), weight, height, age, activity, "".join(list(city)),
+            float(repr(calorie_goal)), int(str(water_goal)))
+
+
+def measure(build, rows):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    fresh = [fetched(row) for row in rows]
+    container = build(fresh)
+    del fresh
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del container
+    return (after - before) / len(rows)
+
+
+def cache_from_rows(rows):
+    cache = ProfileCache(None, max_entries=len(rows))
+    for user_id, *fields in rows:
+        cache._store(user_id, Profile(*fields))
+    return cache
+
+
+async def read_goals(database: Database, cache: ProfileCache, user_ids):
+    started = time.perf_counter()
+    for user_id in user_ids:
+        async with database.read() as db:
+            async with db.execute("SELECT water_goal, calorie_goal FROM users WHERE user_id = ?", (user_id,)) as cursor:
+                await cursor.fetchone()
+    db_us = (time.perf_counter() - started) / len(user_ids) * 1e6
+
+    started = time.perf_counter()
+    for user_id in user_ids:
+        profile = await cache.get(user_id)
+        profile.water_goal, profile.calorie_goal
+    cache_us = (time.perf_counter() - started) / len(user_ids) * 1e6
+    return db_us, cache_us
+
+
+async def main(args):
+    rows = [random_row(user_id) for user_id in range(1, args.profiles + 1)]
+
+    print(f"{'представление':<32} {'байт на профиль':>16}")
+    for name, build in (
+        ("ProfileCache (Profile + LRU)", cache_from_rows),
+        ("dict user_id -> tuple", lambda rows: {row[0]: tuple(row[1:]) for row in rows}),
+        ("dict user_id -> dict", lambda rows: {row[0]: dict(zip(PROFILE_FIELDS, row[1:])) for row in rows}),
+    ):
+        print(f"{name:<32} {measure(build, rows):>16.0f}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = Database(os.path.join(tmp, "bench.db"))
+        await database.open()
+        async with database.write() as db:
+            await migrate(db)
+            await db.executemany("INSERT INTO users (user_id, weight, height, age, activity, city, calorie_goal, water_goal) "
+                                 "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+        cache = ProfileCache(database, max_entries=args.profiles)
+        started = time.perf_counter()
+        await cache.warm()
+        print(f"Прогрев {args.profiles} профилей: {time.perf_counter() - started:.2f} с")
+
+        user_ids = [random.randint(1, args.profiles) for _ in range(args.reads)]
+        db_us, cache_us = await read_goals(database, cache, user_ids)
+        print(f"Чтение норм: база {db_us:.1f} мкс, кэш {cache_us:.2f} мкс на запрос")
+        await database.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Память и скорость кэша профилей")
+    parser.add_argument("--profiles", type=int, default=100000)
+    parser.add_argument("--reads", type=int, default=20000)
+    asyncio.run(main(parser.parse_args()))
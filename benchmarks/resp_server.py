@@ -0,0 +1,166 @@
+import argparse
+import asyncio
+import time
+
+# Минимальный сервер с протоколом Redis (RESP2) для бенчмарков и проверок без
+# настоящего Redis: строки GET/SET (EX/PX)/DEL/EXISTS, pub/sub (SUBSCRIBE/PUBLISH)
+# и служебные PING/SELECT/CLIENT/FLUSHDB. Этого хватает для RedisStorage aiogram
+# и RedisInvalidation из profiles.py. Данные — только в памяти процесса.
+#
+#   python benchmarks/resp_server.py --port 6390
+#   python benchmarks/fsm_storage_bench.py          # сам поднимает такой сервер
+
+
+def _bulk(value) -> bytes:
+    if value is None:
+        return b"$-1\r\n"
+    return b"$%d\r\n%s\r\n" % (len(value), value)
+
+
+def _array(items) -> bytes:
+    return b"*%d\r\n" % len(items) + b"".join(
+        b":%d\r\n" % item if isinstance(item, int) else _bulk(item) for item in items
+    )
+
+
+class RespServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.host = host
+        self.port = port
+        self._data = {}  # ключ -> (значение, срок в monotonic или None)
+        self._channels = {}  # канал -> множество writer'ов подписчиков
+        self._server = None
+
+    @property
+    def url(self) -> str:
+        return f"redis://{self.host}:{self.port}/0"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            for subscribers in self._channels.values():
+                for writer in subscribers:
+                    writer.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    @staticmethod
+    async def _read_command(reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            return line.split()
+        args = []
+        for _ in range(int(line[1:])):
+            size = int((await reader.readline())[1:])
+            args.append((await reader.readexactly(size + 2))[:-2])
+        return args
+
+    def _get(self, key):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires = item
+        if expires is not None and expires <= time.monotonic():
+            del self._data[key]
+            return None
+        return value
+
+    async def _serve(self, reader, writer):
+        subscribed = set()
+        try:
+            while True:
+                try:
+                    args = await self._read_command(reader)
+                except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+                    break
+                if args is None:
+                    break
+                if not args:
+                    continue
+                writer.write(self._execute(args, writer, subscribed))
+                await writer.drain()
+        finally:
+            for channel in subscribed:
+                self._channels.get(channel, set()).discard(writer)
+            writer.close()
+
+    def _execute(self, args, writer, subscribed) -> bytes:
+        command = args[0].upper()
+        if command == b"PING":
+            if subscribed:
+                return _array([b"pong", args[1] if len(args) > 1 else b""])
+            return b"+PONG\r\n"
+        if command in (b"SELECT", b"CLIENT", b"HELLO"):
+            # HELLO отклоняем — клиент останется на RESP2
+            return b"-ERR unknown command\r\n" if command == b"HELLO" else b"+OK\r\n"
+        if command == b"FLUSHDB":
+            self._data.clear()
+            return b"+OK\r\n"
+        if command == b"GET":
+            return _bulk(self._get(args[1]))
+        if command == b"SET":
+            expires = None
+            options = [option.upper() for option in args[3:]]
+            for i, option in enumerate(options[:-1]):
+                if option == b"EX":
+                    expires = time.monotonic() + int(args[4 + i])
+                elif option == b"PX":
+                    expires = time.monotonic() + int(args[4 + i]) / 1000
+            self._data[args[1]] = (args[2], expires)
+            return b"+OK\r\n"
+        if command in (b"DEL", b"EXISTS"):
+            found = sum(self._get(key) is not None for key in args[1:])
+            if command == b"DEL":
+                for key in args[1:]:
+                    self._data.pop(key, None)
+            return b":%d\r\n" % found
+        if command == b"SUBSCRIBE":
+            replies = []
+            for channel in args[1:]:
+                subscribed.add(channel)
+                self._channels.setdefault(channel, set()).add(writer)
+                replies.append(_array([b"subscribe", channel, len(subscribed)]))
+            return b"".join(replies)
+        if command == b"UNSUBSCRIBE":
+            replies = []
+            for channel in args[1:] or list(subscribed):
+                subscribed.discard(channel)
+                self._channels.get(channel, set()).discard(writer)
+                replies.append(_array([b"unsubscribe", channel, len(subscribed)]))
+            return b"".join(replies) or _array([b"unsubscribe", None, 0])
+        if command == b"PUBLISH":
+            subscribers = self._channels.get(args[1], set())
+            message = _array([b"message", args[1], args[2]])
+            for subscriber in subscribers:
+                subscriber.write(message)
+            return b":%d\r\n" % len(subscribers)
+        return b"-ERR unknown command '%s'\r\n" % command
+
+
+async def main(args):
+    async with RespServer(args.host, args.port) as server:
+        print(f"RESP-сервер слушает {server.url}")
+        await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Минимальный Redis-совместимый сервер для бенчмарков")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6390)
+    try:
+        asyncio.run(main(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,132 @@
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS))
+sys.path.insert(0, BENCHMARKS)
+
+# Холодный старт бота: от запуска интерпретатора до ответа на первое обновление.
+# Каждый замер — отдельный процесс, который выполняет настоящий main() (база, миграции,
+# HTTP-клиент, пул графиков, polling), только Telegram заменён заглушкой сессии:
+# getUpdates один раз отдаёт /start, а первый sendMessage останавливает polling.
+# Если медиана превышает --budget, скрипт завершается с кодом 1 — так его можно ставить в CI.
+#
+#   python benchmarks/startup_bench.py --runs 5 --budget 3
+#   python benchmarks/startup_bench.py --importtime   # самые медленные импорты
+
+
+def child(process_started: float):
+    os.environ.setdefault("BOT_TOKEN", "123456:" + "A" * 35)
+    os.environ.setdefault("METRICS_PORT", "0")
+    os.environ.setdefault("SCHEDULER_ENABLED", "0")
+
+    import bot2
+    imported = time.time()
+
+    from aiogram.methods import GetUpdates, SendMessage
+    from load_bench import StubSession, UpdateFactory
+
+    marks = {"import_s": imported - process_started}
+
+    class FirstUpdateSession(StubSession):
+        def __init__(self):
+            super().__init__()
+            self.update = UpdateFactory().build(1, "/start")
+
+        async def make_request(self, bot, method, timeout=None):
+            if isinstance(method, GetUpdates):
+                if self.update is not None:
+                    update, self.update = self.update, None
+                    marks["polling_s"] = time.time() - process_started
+                    return [update]
+                await asyncio.sleep(0.05)
+                return []
+            if isinstance(method, SendMessage) and "first_update_s" not in marks:
+                marks["first_update_s"] = time.time() - process_started
+                self.stopping = asyncio.create_task(bot2.dp.stop_polling())
+            return await super().make_request(bot, method, timeout)
+
+    session = FirstUpdateSession()
+    session.middleware(bot2.delivery)
+    bot2.bot.session = session
+    asyncio.run(bot2.main())
+    print(json.dumps(marks))
+
+
+def run_once(importtime: bool):
+    with tempfile.TemporaryDirectory() as tmp:
+        command = [sys.executable] + (["-X", "importtime"] if importtime else []) + [
+            os.path.abspath(__file__), "--child", repr(time.time()),
+        ]
+        result = subprocess.run(command, cwd=tmp, capture_output=True, text=True, timeout=120)
+    if result.returncode != 0:
+        raise RuntimeError(f"процесс бота завершился с кодом {result.returncode}:\n{result.stderr[-2000:]}")
+    marks = json.loads(result.stdout.strip().splitlines()[-1])
+    return marks, result.stderr
+
+
+def slowest_imports(stderr: str, top: int):
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line.split(":", 1)[1].split("|")
+        rows.append((int(cumulative_us), int(self_us), name[1:].rstrip()))
+    # верхний уровень и его прямые импорты (у bot2 это aiogram, db, charts ...);
+    # строки воркеров графиков тоже попадают сюда — -X importtime наследуется дочерними процессами
+    shallow = {}
+    for cumulative, self_us, name in rows:
+        if len(name) - len(name.lstrip()) <= 2:
+            shallow.setdefault(name.strip(), (cumulative, self_us, name.strip()))
+    return sorted(shallow.values(), reverse=True)[:top]
+
+
+def main(args):
+    runs = []
+    for _ in range(args.runs):
+        marks, _ = run_once(importtime=False)
+        runs.append(marks)
+        print(f"импорт {marks['import_s']:.2f} с, polling {marks['polling_s']:.2f} с, первый ответ {marks['first_update_s']:.2f} с")
+
+    report = {
+        key: {"median": statistics.median(run[key] for run in runs), "max": max(run[key] for run in runs)}
+        for key in ("import_s", "polling_s", "first_update_s")
+    }
+    median = report["first_update_s"]["median"]
+    print(f"Медиана до первого ответа: {median:.2f} с (бюджет {args.budget:.2f} с)")
+
+    if args.importtime:
+        _, stderr = run_once(importtime=True)
+        print(f"{'модуль':<40} {'всего, мс':>10} {'свои, мс':>10}")
+        for cumulative, self_us, name in slowest_imports(stderr, args.top):
+            print(f"{name:<40} {cumulative / 1000:>10.1f} {self_us / 1000:>10.1f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"budget_s": args.budget, "runs": runs, "summary": report}, f, ensure_ascii=False, indent=2)
+
+    if median > args.budget:
+        print("Бюджет холодного старта превышен")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--child":
+        child(float(sys.argv[2]))
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description="Время холодного старта бота до первого ответа")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=3.0, help="допустимая медиана до первого ответа, с")
+    parser.add_argument("--importtime", action="store_true", help="показать самые медленные импорты (python -X importtime)")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--output", help="сохранить замеры в JSON")
+    sys.exit(main(parser.parse_args()))
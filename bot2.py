@@ -1,83 +1,135 @@
 import asyncio
+import hashlib
 import logging
 import os
-import aiosqlite
-import aiohttp
+import tempfile
 from aiogram import Bot, Dispatcher, types, F
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton
-import pytz  
-import matplotlib.pyplot as plt
 import io
 from datetime import datetime, timedelta
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile, CallbackQuery
+from zoneinfo import ZoneInfo
+from typing import NamedTuple
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, BufferedInputFile, CallbackQuery, FSInputFile
 import random
 from dotenv import load_dotenv
+from db import Database, LogWriter, day_key, migrate
+from charts import ChartCache, ChartQueueFull, ChartRenderer, render_progress_chart, render_trend_chart
+from http_client import HttpClient, Upstream, UpstreamError
+from weather import WeatherCache
+from fsm_storage import create_storage
+from delivery import Delivery
+from scheduler import Scheduler, TaskJob, default_jobs
+from retention import compact_logs
+from goals import DEFAULT_TEMPERATURE, goals_for, recompute_goals
+from cohorts import CohortStats, compute_cohort_stats, stats_window
+from user_data import EXPORT_FORMATS, ImportFormatError, export_user_data, import_user_data
+from metrics import REGISTRY, HandlerMetrics, UpdateMetrics, metric_lines, timed
+from loop_watchdog import LoopWatchdog
+from food_catalog import add_food, search_food
+from profiles import PROFILE_CACHE_SYNCS, Profile, ProfileCache, RedisInvalidation
+from meals import is_meal, parse_meal, resolve_meal
+from trends import TREND_RANGES, build_trend_report, format_trend_report, load_daily_totals
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
+# часовой пояс, в котором считаются «сегодня» и время рассылок
+LOCAL_TZ = ZoneInfo(os.getenv("BOT_TIMEZONE", "Europe/Moscow"))
 OPENWEATHER_API_KEY = os.getenv("OPENWEATHER_API_KEY")
+WEATHER_CACHE_TTL = int(os.getenv("WEATHER_CACHE_TTL", "1800"))
+# адреса внешних API (переопределяются, например, заглушками в benchmarks/load_bench.py)
+OPENWEATHER_URL = os.getenv("OPENWEATHER_URL", "http://api.openweathermap.org/data/2.5/weather")
+OPENFOODFACTS_URL = os.getenv("OPENFOODFACTS_URL", "https://world.openfoodfacts.org/cgi/search.pl")
+# сколько продуктов из одного приёма пищи искать одновременно
+MEAL_LOOKUP_CONCURRENCY = int(os.getenv("MEAL_LOOKUP_CONCURRENCY", "4"))
+
+# webhook включается, если задан публичный адрес; иначе — long polling
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or hashlib.sha256(f"webhook:{BOT_TOKEN}".encode()).hexdigest()
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.getenv("WEBAPP_PORT", "8080"))
+# /metrics (Prometheus) и /health на отдельном сервере METRICS_HOST:METRICS_PORT (и при polling,
+# и при webhook), по умолчанию только локальный — наружу метрики открываются явно
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9090"))
+# сторож event loop: логирует и считает места, где код блокирует loop дольше порога (мс)
+LOOP_WATCHDOG = os.getenv("LOOP_WATCHDOG", "0") == "1"
+LOOP_WATCHDOG_THRESHOLD_MS = int(os.getenv("LOOP_WATCHDOG_THRESHOLD_MS", "100"))
+
+# где хранить состояния диалогов: sqlite (база бота), redis или memory
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite")
+REDIS_URL = os.getenv("REDIS_URL")
+FSM_STATE_TTL = int(os.getenv("FSM_STATE_TTL", "86400"))
+# кэш профилей в памяти; сброс между процессами: redis (pub/sub через REDIS_URL) или none
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "100000"))
+PROFILE_CACHE_SYNC = os.getenv("PROFILE_CACHE_SYNC", "redis" if FSM_STORAGE == "redis" else "none")
+if PROFILE_CACHE_SYNC not in PROFILE_CACHE_SYNCS:
+    raise ValueError(f"Неизвестный PROFILE_CACHE_SYNC: {PROFILE_CACHE_SYNC}, доступны: {', '.join(PROFILE_CACHE_SYNCS)}")
+# срок жизни записи кэша, с: без рассылки сбросов — насколько могут отставать изменения
+# из другого процесса на той же базе; «профиля нет» живёт не дольше PROFILE_CACHE_NEGATIVE_TTL
+PROFILE_CACHE_TTL = int(os.getenv("PROFILE_CACHE_TTL", "3600" if PROFILE_CACHE_SYNC == "redis" else "300"))
+PROFILE_CACHE_NEGATIVE_TTL = int(os.getenv("PROFILE_CACHE_NEGATIVE_TTL", "30"))
+
+# плановые рассылки: напоминания о воде (время через запятую) и вечерняя сводка, по LOCAL_TZ
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "1") != "0"
+REMINDER_TIMES = [t.strip() for t in os.getenv("REMINDER_TIMES", "14:00,18:00").split(",") if t.strip()]
+DIGEST_TIME = os.getenv("DIGEST_TIME", "21:30")
+# сырые логи старше LOG_RETENTION_DAYS ежедневно сжимаются до итогов по дням (0 — хранить всё)
+LOG_RETENTION_DAYS = int(os.getenv("LOG_RETENTION_DAYS", "365"))
+RETENTION_TIME = os.getenv("RETENTION_TIME", "04:00")
+# ночной пересчёт распределений по когортам для сравнения в рекомендациях
+STATS_TIME = os.getenv("STATS_TIME", "03:30")
+# пересчёт норм воды и калорий всех пользователей по текущей погоде (пусто — не пересчитывать)
+GOALS_TIME = os.getenv("GOALS_TIME", "07:00")
 
 
 logging.basicConfig(level=logging.INFO)
 
+http_client = HttpClient()
+WEATHER_UPSTREAM = Upstream("openweathermap", timeout=3, retries=2)
+FOOD_UPSTREAM = Upstream("openfoodfacts", timeout=5, retries=1)
+
+async def fetch_temperature(city: str):
+    url = OPENWEATHER_URL
+    params = {"q": city, "units": "metric", "appid": OPENWEATHER_API_KEY or ""}
+
+    try:
+        data = await http_client.get_json(WEATHER_UPSTREAM, url, params=params)
+        return data["main"]["temp"]
+    except (UpstreamError, KeyError, TypeError) as e:
+        logging.warning("Ошибка API OpenWeatherMap: %s", e)
+        return None
+
+weather_cache = WeatherCache(fetch_temperature, ttl=WEATHER_CACHE_TTL, negative_ttl=60)
+
+@timed
 async def get_temperature(city: str):
-    url = f"http://api.openweathermap.org/data/2.5/weather?q={city}&units=metric&appid={OPENWEATHER_API_KEY}"
-    
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url) as response:
-            if response.status == 200:
-                data = await response.json()
-                temp = data["main"]["temp"]
-                return temp 
-            else:
-                print(f"Ошибка API OpenWeatherMap: {response.status}")
-                return None
+    return await weather_cache.get(city)
 
-bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher()
 DB_NAME = "bot_database.db"
+db_pool = Database(DB_NAME)
+log_writer = LogWriter(db_pool, max_batch=200, max_delay=0.005)
+bot = Bot(token=BOT_TOKEN)
+delivery = Delivery(global_rate=30, chat_rate=1, chat_burst=3)
+bot.session.middleware(delivery)
+dp = Dispatcher(storage=create_storage(FSM_STORAGE, db_pool, redis_url=REDIS_URL, ttl=FSM_STATE_TTL))
+chart_renderer = ChartRenderer(workers=2, max_pending=16)
+chart_cache = ChartCache(max_entries=10000)
+cohort_stats = CohortStats(db_pool)
+profile_cache = ProfileCache(db_pool, max_entries=PROFILE_CACHE_SIZE,
+                             ttl=PROFILE_CACHE_TTL, negative_ttl=PROFILE_CACHE_NEGATIVE_TTL)
+profile_sync = RedisInvalidation(profile_cache, REDIS_URL or "redis://localhost:6379/0") if PROFILE_CACHE_SYNC == "redis" else None
+CHART_LOCALE = "ru"
+dp.update.outer_middleware(UpdateMetrics())
+dp.message.middleware(HandlerMetrics())
+dp.callback_query.middleware(HandlerMetrics())
 
 async def init_db():
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                weight INTEGER,
-                height INTEGER,
-                age INTEGER,
-                activity INTEGER,
-                city TEXT,
-                calorie_goal INTEGER,
-                water_goal INTEGER
-            )
-        """)
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS water_logs (
-                user_id INTEGER,
-                date TEXT,
-                amount INTEGER
-            )
-        """)
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS food_logs (
-                user_id INTEGER,
-                date TEXT,
-                food_name TEXT,
-                calories REAL
-            )
-        """)
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS workout_logs (
-                user_id INTEGER,
-                date TEXT,
-                workout_type TEXT,
-                duration INTEGER,
-                calories_burned INTEGER
-            )
-        """)
-        await db.commit()
+    async with db_pool.write() as db:
+        await migrate(db)
 
 class ProfileSetup(StatesGroup):
     weight = State()
@@ -162,48 +214,22 @@ async def set_city(message: Message, state: FSMContext):
     temp = await get_temperature(city)
     if temp is None:
         await message.answer("⚠ Не удалось получить температуру. Норма воды будет рассчитана без учёта погоды.")
-        temp = 20  
+        temp = DEFAULT_TEMPERATURE
 
     weight = data["weight"]
     height = data["height"]
     age = data["age"]
     activity = data["activity"]
 
-    # Расчёт нормы воды
-    water_goal = weight * 25
-    water_goal += (activity // 30) * 150  # +150 мл за каждые 30 мин активности
-
-    if temp > 25:
-        water_goal += 250  # Жара больше воды
-    elif temp < 0:
-        water_goal -= 200  # Мороз меньше воды
+    calorie_goal, water_goal = goals_for(weight, height, age, activity, temp)
 
-    water_goal = min(water_goal, 4000) 
-    water_goal = round(water_goal, 2)  
-
-
-    #   Расчёт нормы калорий
-    bmr = (10 * weight) + (6.25 * height) - (5 * age) + 5  # Основной обмен
-
-    if activity < 30:
-        calorie_goal = bmr * 1.2  # Малоподвижный образ жизни
-    elif activity < 60:
-        calorie_goal = bmr * 1.375  # Лёгкая активность
-    elif activity < 120:
-        calorie_goal = bmr * 1.55  # Средняя активность
-    elif activity < 180:
-        calorie_goal = bmr * 1.725  # Высокая активность
-    else:
-        calorie_goal = bmr * 1.9  # Очень активный образ жизни
-
-    calorie_goal = round(calorie_goal, 2) 
-
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with db_pool.write() as db:
         await db.execute(
             "INSERT OR REPLACE INTO users (user_id, weight, height, age, activity, city, calorie_goal, water_goal) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
             (message.from_user.id, weight, height, age, activity, city, calorie_goal, water_goal)
         )
-        await db.commit()
+    profile_cache.put(message.from_user.id, Profile(weight, height, age, activity, city, calorie_goal, water_goal))
+    chart_cache.invalidate(message.from_user.id)
 
     await state.clear()
     await message.answer(
@@ -245,8 +271,7 @@ async def check_progress(callback: CallbackQuery, state: FSMContext):
         await callback.message.answer("📅 Введите дату в формате ДД-ММ-ГГГГ (например, 05-02-2025):")
         await state.set_state(CheckProgress.waiting_for_date) 
     else:
-        await show_progress(callback.message, user_id, selected_date)
-        await plot_progress_graph(callback.message, user_id, selected_date)
+        await send_progress_report(callback.message, user_id, selected_date)
         await callback.answer()
 
 # ввод даты
@@ -257,101 +282,94 @@ async def process_custom_date(message: Message, state: FSMContext):
 
     try:
         datetime.strptime(date_input, "%d-%m-%Y")
-        await show_progress(message, user_id, date_input)
-        await plot_progress_graph(message, user_id, date_input)  
+        await send_progress_report(message, user_id, date_input)
         await state.clear() 
     except ValueError:
         await message.answer("❌ Неверный формат даты. Введите в формате ДД-ММ-ГГГГ (например, 05-02-2025):")
 
-# отчет
-async def show_progress(message: Message, user_id: int, selected_date: str):
-    db_date = datetime.strptime(selected_date, "%d-%m-%Y").strftime("%Y-%m-%d") 
-
-    async with aiosqlite.connect("bot_database.db") as db:
-        async with db.execute("SELECT water_goal, calorie_goal FROM users WHERE user_id = ?", (user_id,)) as cursor:
-            user_data = await cursor.fetchone()
-
-        async with db.execute("SELECT SUM(amount) FROM water_logs WHERE user_id = ? AND DATE(date) = ?", (user_id, db_date)) as water_cursor:
-            water_total = await water_cursor.fetchone()
-
-        async with db.execute("SELECT SUM(calories) FROM food_logs WHERE user_id = ? AND DATE(date) = ?", (user_id, db_date)) as food_cursor:
-            food_total = await food_cursor.fetchone()
-
-        async with db.execute("SELECT SUM(calories_burned) FROM workout_logs WHERE user_id = ? AND DATE(date) = ?", (user_id, db_date)) as workout_cursor:
-            burned_total = await workout_cursor.fetchone()
-
-    if not user_data:
+BURNED_GOAL = 500
+
+# нормы и итоги пользователя за день
+class DailySnapshot(NamedTuple):
+    user_id: int
+    day: int
+    date: str
+    water_goal: int
+    calorie_goal: float
+    water_total: int
+    food_total: float
+    burned_total: int
+    burned_goal: int = BURNED_GOAL
+
+    @property
+    def balance(self):
+        return self.food_total - self.burned_total
+
+# профиль и итоги дня одним запросом; None, если профиля нет
+@timed
+async def load_daily_snapshot(user_id: int, selected_date: str):
+    day = day_key(datetime.strptime(selected_date, "%d-%m-%Y"))
+    profile = await profile_cache.get(user_id)
+    if profile is None:
+        return None
+
+    async with db_pool.read() as db:
+        async with db.execute(
+            "SELECT water_ml, kcal_in, kcal_burned FROM daily_totals WHERE user_id = ? AND day = ?", (user_id, day)
+        ) as cursor:
+            row = await cursor.fetchone()
+
+    return DailySnapshot(user_id, day, selected_date, profile.water_goal, profile.calorie_goal, *(row or (0, 0, 0)))
+
+# отчет + график по одному снимку
+async def send_progress_report(message: Message, user_id: int, selected_date: str):
+    snapshot = await load_daily_snapshot(user_id, selected_date)
+    if snapshot is None:
         await message.answer("❌ У тебя нет профиля. Используй /set_profile")
         return
-    
-    water_goal, calorie_goal = user_data
-    burned_goal = 500
 
-    water_total = water_total[0] if water_total[0] else 0
-    food_total = food_total[0] if food_total[0] else 0
-    burned_total = burned_total[0] if burned_total[0] else 0
-    balance = food_total - burned_total
+    await show_progress(message, snapshot)
+    await plot_progress_graph(message, snapshot)
 
-    progress_text = f"""📊 Прогресс за {selected_date}:
-💧 Вода: {water_total} мл / {water_goal} мл  
-🍏 Калории съедено: {food_total} ккал / {calorie_goal} ккал  
-🔥 Сожжено калорий: {burned_total} ккал / {burned_goal} ккал  
-⚖ Баланс: {balance} ккал  
+# отчет
+@timed
+async def show_progress(message: Message, snapshot: DailySnapshot):
+    progress_text = f"""📊 Прогресс за {snapshot.date}:
+💧 Вода: {snapshot.water_total} мл / {snapshot.water_goal} мл  
+🍏 Калории съедено: {snapshot.food_total} ккал / {snapshot.calorie_goal} ккал  
+🔥 Сожжено калорий: {snapshot.burned_total} ккал / {snapshot.burned_goal} ккал  
+⚖ Баланс: {snapshot.balance} ккал  
 """
 
     await message.answer(progress_text)
 
 # графики
-async def plot_progress_graph(message: Message, user_id: int, selected_date: str):
-    db_date = datetime.strptime(selected_date, "%d-%m-%Y").strftime("%Y-%m-%d")
-
-    async with aiosqlite.connect("bot_database.db") as db:
-        async with db.execute("SELECT water_goal, calorie_goal FROM users WHERE user_id = ?", (user_id,)) as cursor:
-            user_data = await cursor.fetchone()
-
-        async with db.execute("SELECT SUM(amount) FROM water_logs WHERE user_id = ? AND DATE(date) = ?", (user_id, db_date)) as water_cursor:
-            water_total = await water_cursor.fetchone()
-
-        async with db.execute("SELECT SUM(calories) FROM food_logs WHERE user_id = ? AND DATE(date) = ?", (user_id, db_date)) as food_cursor:
-            food_total = await food_cursor.fetchone()
-
-        async with db.execute("SELECT SUM(calories_burned) FROM workout_logs WHERE user_id = ? AND DATE(date) = ?", (user_id, db_date)) as workout_cursor:
-            burned_total = await workout_cursor.fetchone()
-
-    water_goal, calorie_goal = user_data
-    burned_goal = 500
-
-    water_total = water_total[0] if water_total[0] else 0
-    food_total = food_total[0] if food_total[0] else 0
-    burned_total = burned_total[0] if burned_total[0] else 0
-
+@timed
+async def plot_progress_graph(message: Message, snapshot: DailySnapshot):
     categories = ["💧 Вода", "🍏 Калории", "🔥 Сожжено"]
-    goal_values = [water_goal, calorie_goal, burned_goal]
-    actual_values = [water_total, food_total, burned_total]
+    goal_values = [snapshot.water_goal, snapshot.calorie_goal, snapshot.burned_goal]
+    actual_values = [snapshot.water_total, snapshot.food_total, snapshot.burned_total]
 
-    fig, ax = plt.subplots(figsize=(6, 4))
-    bar_width = 0.4
-    x = range(len(categories))
+    caption = f"📊 График прогресса за {snapshot.date}"
 
-    ax.bar(x, goal_values, width=bar_width, label="Норма", alpha=0.6)
-    ax.bar([i + bar_width for i in x], actual_values, width=bar_width, label="Фактически", alpha=0.8)
-
-    ax.set_xticks([i + bar_width / 2 for i in x])
-    ax.set_xticklabels(categories)
-    ax.set_ylabel("Единицы измерения")
-    ax.set_title(f"📊 Прогресс за {selected_date}")
-    ax.legend()
-
-    filename = f"progress_{user_id}.png"
-    plt.savefig(filename, format="png")
-    plt.close()
+    cache_key = ChartCache.key(goal_values, actual_values, snapshot.date, CHART_LOCALE)
+    file_id = chart_cache.get(cache_key)
+    if file_id:
+        await message.answer_photo(file_id, caption=caption)
+        return
 
-    graph = FSInputFile(filename)
-    await message.answer_photo(graph, caption=f"📊 График прогресса за {selected_date}")
-    os.remove(filename)
+    try:
+        png = await chart_renderer.render(
+            render_progress_chart, f"📊 Прогресс за {snapshot.date}", categories, goal_values, actual_values
+        )
+    except ChartQueueFull:
+        await message.answer("⏳ Сейчас строится слишком много графиков. Попробуйте чуть позже.")
+        return
 
+    graph = BufferedInputFile(png, filename="progress.png")
+    sent = await message.answer_photo(graph, caption=caption)
+    chart_cache.put(snapshot.user_id, snapshot.day, cache_key, sent.photo[-1].file_id)
 
-LOCAL_TZ = pytz.timezone("Europe/Moscow")  
 # логирование воды
 class LogWater(StatesGroup):
     amount = State()
@@ -372,20 +390,19 @@ async def save_water_log(message: Message, state: FSMContext):
         return
 
     amount = int(message.text)
-    db_date = datetime.now(LOCAL_TZ).strftime("%Y-%m-%d %H:%M:%S")
-
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("INSERT INTO water_logs (user_id, date, amount) VALUES (?, ?, ?)", (user_id, db_date, amount))
-        await db.commit()
-
-        async with db.execute("SELECT SUM(amount) FROM water_logs WHERE user_id = ? AND strftime('%Y-%m-%d', date) = ?", (user_id, db_date[:10])) as water_cursor:
-            water_total = await water_cursor.fetchone()
-
-        async with db.execute("SELECT water_goal FROM users WHERE user_id = ?", (user_id,)) as user_cursor:
-            user_data = await user_cursor.fetchone()
+    now = datetime.now(LOCAL_TZ)
+    db_date = now.strftime("%Y-%m-%d %H:%M:%S")
+    day = day_key(now)
+
+    profile = await profile_cache.get(user_id)
+    (water_total,) = await log_writer.write(
+        "INSERT INTO water_logs (user_id, date, day, amount) VALUES (?, ?, ?, ?)", (user_id, db_date, day, amount),
+        "SELECT (SELECT water_ml FROM daily_totals WHERE user_id = ? AND day = ?)", (user_id, day),
+    )
+    chart_cache.invalidate(user_id, day)
 
-    water_total = water_total[0] if water_total[0] else 0
-    water_goal = user_data[0] if user_data else 2000  
+    water_total = water_total or 0
+    water_goal = profile.water_goal if profile and profile.water_goal is not None else 2000
     water_remaining = max(0, water_goal - water_total)
 
     await state.clear()
@@ -405,30 +422,60 @@ class LogFood(StatesGroup):
     food_weight = State()
 
 # данные о калориях из OpenFoodFacts
-async def get_food_info(product_name):
-    url = f"https://world.openfoodfacts.org/cgi/search.pl?action=process&search_terms={product_name}&json=true"
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url) as response:
-            data = await response.json()
-            products = data.get("products", [])
-            if products:
-                first_product = products[0]
-                return {
-                    "name": first_product.get("product_name", "Неизвестно"),
-                    "calories": first_product.get("nutriments", {}).get("energy-kcal_100g", 0)
-                }
+async def fetch_food_info(product_name):
+    url = OPENFOODFACTS_URL
+    params = {"action": "process", "search_terms": product_name, "json": "true"}
+
+    try:
+        data = await http_client.get_json(FOOD_UPSTREAM, url, params=params)
+    except UpstreamError as e:
+        logging.warning("Ошибка API OpenFoodFacts: %s", e)
+        return None
+
+    products = data.get("products", []) if isinstance(data, dict) else []
+    if products:
+        first_product = products[0]
+        kcal = first_product.get("nutriments", {}).get("energy-kcal_100g")
+        return {
+            "name": first_product.get("product_name", "Неизвестно"),
+            "calories": kcal or 0,
+            # как пришло от API: без калорийности продукт в каталог не попадёт
+            "kcal_100g": kcal,
+        }
     return None
 
-# /log_food
+# сначала локальный каталог, в OpenFoodFacts только при промахе
+@timed
+async def get_food_info(product_name):
+    async with db_pool.read() as db:
+        food_info = await search_food(db, product_name)
+    if food_info:
+        return food_info
+
+    food_info = await fetch_food_info(product_name)
+    if food_info and food_info["name"] != "Неизвестно":
+        async with db_pool.write() as db:
+            await add_food(db, food_info["name"], food_info["kcal_100g"])
+    return food_info
+
+# /log_food или сразу весь приём пищи: /log_food 200 г гречка, 1 яблоко
 @dp.message(Command("log_food"))
-async def log_food(message: Message, state: FSMContext):
-    await message.answer("🍽 Введите название продукта:")
+async def log_food(message: Message, state: FSMContext, command: CommandObject = None):
+    items = parse_meal(command.args) if command and command.args else []
+    if is_meal(items):
+        await log_meal(message, state, items)
+        return
+    await message.answer("🍽 Введите название продукта или весь приём пищи (например: 200 г гречка, 1 яблоко):")
     await state.set_state(LogFood.food_name)
 
 # Получение данных о калориях
 @dp.message(LogFood.food_name)
 async def get_food_weight(message: Message, state: FSMContext):
     food_name = message.text
+    items = parse_meal(food_name)
+    if is_meal(items, bare_numbers=False):
+        await log_meal(message, state, items)
+        return
     food_info = await get_food_info(food_name)
 
     if food_info:
@@ -440,7 +487,6 @@ async def get_food_weight(message: Message, state: FSMContext):
         await state.clear()
 
 
-LOCAL_TZ = pytz.timezone("Europe/Moscow") 
 
 @dp.message(LogFood.food_weight)
 async def save_food_log(message: Message, state: FSMContext):
@@ -453,21 +499,21 @@ async def save_food_log(message: Message, state: FSMContext):
         food_weight = int(message.text)
         total_calories = (calories_per_100g * food_weight) / 100 
 
-        db_date = datetime.now(LOCAL_TZ).strftime("%Y-%m-%d")  
-        display_date = datetime.now(LOCAL_TZ).strftime("%d-%m-%Y")  
-
-        async with aiosqlite.connect(DB_NAME) as db:
-            await db.execute("INSERT INTO food_logs (user_id, date, food_name, calories) VALUES (?, ?, ?, ?)",
-                            (user_id, db_date, food_name, total_calories))
-            await db.commit()
-            async with db.execute("SELECT SUM(calories) FROM food_logs WHERE user_id = ? AND date = ?", (user_id, db_date)) as food_cursor:
-                food_total = await food_cursor.fetchone()
+        now = datetime.now(LOCAL_TZ)
+        db_date = now.strftime("%Y-%m-%d")  
+        display_date = now.strftime("%d-%m-%Y")  
+        day = day_key(now)
 
-            async with db.execute("SELECT calorie_goal FROM users WHERE user_id = ?", (user_id,)) as user_cursor:
-                user_data = await user_cursor.fetchone()
+        profile = await profile_cache.get(user_id)
+        (food_total,) = await log_writer.write(
+            "INSERT INTO food_logs (user_id, date, day, food_name, calories) VALUES (?, ?, ?, ?, ?)",
+            (user_id, db_date, day, food_name, total_calories),
+            "SELECT (SELECT kcal_in FROM daily_totals WHERE user_id = ? AND day = ?)", (user_id, day),
+        )
+        chart_cache.invalidate(user_id, day)
 
-        food_total = food_total[0] if food_total[0] else 0
-        calorie_goal = user_data[0] if user_data else 2000  
+        food_total = food_total or 0
+        calorie_goal = profile.calorie_goal if profile and profile.calorie_goal is not None else 2000
         calories_remaining = max(0, calorie_goal - food_total)
 
         await state.clear()
@@ -484,27 +530,73 @@ async def save_food_log(message: Message, state: FSMContext):
 
 
 
+# Несколько продуктов одним сообщением: поиск параллельно, запись одной транзакцией, один ответ
+async def log_meal(message: Message, state: FSMContext, items):
+    user_id = message.from_user.id
+    resolved = await resolve_meal(items, get_food_info, concurrency=MEAL_LOOKUP_CONCURRENCY)
+
+    now = datetime.now(LOCAL_TZ)
+    db_date = now.strftime("%Y-%m-%d")
+    display_date = now.strftime("%d-%m-%Y")
+    day = day_key(now)
+
+    rows, lines, missing = [], [], []
+    for item, food_info in resolved:
+        if item.grams is None:
+            missing.append(f"{item.text} (не указан вес)")
+        elif not food_info:
+            missing.append(item.text)
+        else:
+            calories = (food_info["calories"] or 0) * item.grams / 100
+            rows.append((user_id, db_date, day, food_info["name"], calories))
+            amount = f"{item.pieces:g} шт ≈ {item.grams:g} г" if item.pieces is not None else f"{item.grams:g} г"
+            lines.append(f"✅ {food_info['name']}: {amount} — {calories:.2f} ккал")
+
+    await state.clear()
+    if not rows:
+        await message.answer("❌ Не удалось найти ни одного продукта:\n" + "\n".join(f"• {text}" for text in missing))
+        return
+
+    profile = await profile_cache.get(user_id)
+    (food_total,) = await log_writer.write_many(
+        "INSERT INTO food_logs (user_id, date, day, food_name, calories) VALUES (?, ?, ?, ?, ?)", rows,
+        "SELECT (SELECT kcal_in FROM daily_totals WHERE user_id = ? AND day = ?)", (user_id, day),
+    )
+    chart_cache.invalidate(user_id, day)
+
+    food_total = food_total or 0
+    calorie_goal = profile.calorie_goal if profile and profile.calorie_goal is not None else 2000
+    calories_remaining = max(0, calorie_goal - food_total)
+    added = sum(row[-1] for row in rows)
+
+    progress_text = f"🍽 Приём пищи ({display_date}):\n" + "\n".join(lines) + "\n"
+    if missing:
+        progress_text += "❌ Не найдено: " + ", ".join(missing) + "\n"
+    progress_text += f"""➕ Добавлено: {added:.2f} ккал
+🔥 Потреблено всего: {food_total:.2f} ккал / {calorie_goal} ккал
+🔹 Осталось: {calories_remaining:.2f} ккал
+"""
+    await message.answer(progress_text)
+
+
 # просмотр профиля
 @dp.message(Command("profile"))
 @dp.message(F.text.casefold() == "📋 профиль")
 async def view_profile(message: Message):
-    user_id = message.from_user.id
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute("SELECT weight, height, age, activity, city, calorie_goal, water_goal FROM users WHERE user_id = ?", (user_id,)) as cursor:
-            user = await cursor.fetchone()
+    user = await profile_cache.get(message.from_user.id)
 
     if user:
         profile_info = f"""
         👤 ВАШ ПРОФИЛЬ
         ━━━━━━━━━━━━━━━━━━━━
-        ⚖️ ВЕС: {user[0]} кг
-        📏 РОСТ: {user[1]} см
-        🎂 ВОЗРАСТ: {user[2]} лет
-        🚴 АКТИВНОСТЬ: {user[3]} мин/день
-        📍 ГОРОД: {user[4]}
+        ⚖️ ВЕС: {user.weight} кг
+        📏 РОСТ: {user.height} см
+        🎂 ВОЗРАСТ: {user.age} лет
+        🚴 АКТИВНОСТЬ: {user.activity} мин/день
+        📍 ГОРОД: {user.city}
         ━━━━━━━━━━━━━━━━━━━━
-        🍽 ЦЕЛЬ ПО КАЛОРИЯМ: {user[5]} ккал
-        💦 ЦЕЛЬ ПО ВОДЕ: {user[6]} мл
+        🍽 ЦЕЛЬ ПО КАЛОРИЯМ: {user.calorie_goal} ккал
+        💦 ЦЕЛЬ ПО ВОДЕ: {user.water_goal} мл
         ━━━━━━━━━━━━━━━━━━━━
         """
 
@@ -568,17 +660,18 @@ async def save_workout_log(message: Message, state: FSMContext):
         }[workout_type]
 
         # Получаем текущую дату в формате БД
-        local_date = datetime.now(LOCAL_TZ).strftime("%Y-%m-%d")
-
-        async with aiosqlite.connect(DB_NAME) as db:
-            await db.execute("INSERT INTO workout_logs (user_id, date, workout_type, duration, calories_burned) VALUES (?, ?, ?, ?, ?)",
-                            (user_id, local_date, workout_type, duration, calories_burned))
-            await db.commit()
-
-            async with db.execute("SELECT SUM(calories_burned) FROM workout_logs WHERE user_id = ? AND date = ?", (user_id, local_date)) as workout_cursor:
-                burned_total = await workout_cursor.fetchone()
-
-        burned_total = burned_total[0] if burned_total[0] else 0
+        now = datetime.now(LOCAL_TZ)
+        local_date = now.strftime("%Y-%m-%d")
+        day = day_key(now)
+
+        (burned_total,) = await log_writer.write(
+            "INSERT INTO workout_logs (user_id, date, day, workout_type, duration, calories_burned) VALUES (?, ?, ?, ?, ?, ?)",
+            (user_id, local_date, day, workout_type, duration, calories_burned),
+            "SELECT (SELECT kcal_burned FROM daily_totals WHERE user_id = ? AND day = ?)",
+            (user_id, day),
+        )
+        chart_cache.invalidate(user_id, day)
+        burned_total = burned_total or 0
 
         await state.clear()
 
@@ -592,6 +685,119 @@ async def save_workout_log(message: Message, state: FSMContext):
         await message.answer("❌ Введите число (продолжительность тренировки в минутах).")
 
 
+# тренды за 7/30/90 дней
+def get_trends_keyboard():
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=f"📈 {days} дней", callback_data=f"trends:{days}") for days in TREND_RANGES]
+    ])
+    return keyboard
+
+# /trends
+@dp.message(Command("trends"))
+async def trends_request(message: Message):
+    await message.answer("📈 За какой период показать тренды?", reply_markup=get_trends_keyboard())
+
+@dp.callback_query(lambda c: c.data.startswith("trends:"))
+async def show_trends(callback: CallbackQuery):
+    await callback.answer()
+    user_id = callback.from_user.id
+    days = int(callback.data.split(":")[1])
+    if days not in TREND_RANGES:
+        return
+
+    end = datetime.now(LOCAL_TZ).date()
+    start = end - timedelta(days=days - 1)
+
+    profile = await profile_cache.get(user_id)
+    if profile is None or profile.water_goal is None or profile.calorie_goal is None:
+        await callback.message.answer("❌ У тебя нет профиля. Используй /set_profile")
+        return
+
+    async with db_pool.read() as db:
+        rows = await load_daily_totals(db, user_id, start, end)
+
+    report = build_trend_report(rows, end, days, profile.water_goal, profile.calorie_goal)
+    await callback.message.answer(format_trend_report(report))
+
+    try:
+        png = await chart_renderer.render(
+            render_trend_chart,
+            f"Тренды за {days} дн.",
+            [d.strftime("%d.%m") for d in report.dates],
+            report.water, report.water_avg, report.water_goal,
+            report.kcal_in - report.kcal_burned, report.kcal_avg, report.calorie_goal,
+        )
+    except ChartQueueFull:
+        await callback.message.answer("⏳ Сейчас строится слишком много графиков. Попробуйте чуть позже.")
+        return
+
+    await callback.message.answer_photo(BufferedInputFile(png, filename="trends.png"))
+
+
+# выгрузка всей истории: /export или /export jsonl
+@dp.message(Command("export"))
+async def export_data(message: Message, command: CommandObject):
+    fmt = (command.args or "csv").strip().lower()
+    if fmt not in EXPORT_FORMATS:
+        await message.answer(f"❌ Формат выгрузки: {', '.join(EXPORT_FORMATS)}. Например: /export jsonl")
+        return
+
+    user_id = message.from_user.id
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, f"diet_{user_id}.{fmt}.gz")
+        count = await export_user_data(db_pool, user_id, path, fmt)
+        if not count:
+            await message.answer("📭 Пока нечего выгружать.")
+            return
+        await message.answer_document(FSInputFile(path), caption=f"📦 Выгрузка истории, записей: {count}")
+
+
+# загрузка истории из файла /export
+MAX_IMPORT_BYTES = 20 * 1024 * 1024  # больше бот скачать не может
+
+class ImportData(StatesGroup):
+    waiting_file = State()
+
+@dp.message(Command("import"))
+async def import_request(message: Message, state: FSMContext):
+    await message.answer("📥 Пришлите файл, полученный командой /export (.csv.gz или .jsonl.gz).")
+    await state.set_state(ImportData.waiting_file)
+
+@dp.message(ImportData.waiting_file, F.document)
+async def import_data(message: Message, state: FSMContext):
+    if (message.document.file_size or 0) > MAX_IMPORT_BYTES:
+        await message.answer("❌ Файл слишком большой (максимум 20 МБ).")
+        return
+
+    user_id = message.from_user.id
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "import")
+        await bot.download(message.document, destination=path)
+        try:
+            counts, skipped = await import_user_data(db_pool, user_id, path)
+        except ImportFormatError as e:
+            await message.answer(f"❌ Не удалось загрузить: {e}")
+            return
+        finally:
+            chart_cache.invalidate(user_id)
+            profile_cache.invalidate(user_id)
+
+    await state.clear()
+    await message.answer(
+        f"✅ Загружено:\n"
+        f"💧 Вода: {counts['water']}\n"
+        f"🍏 Еда: {counts['food']}\n"
+        f"🏋 Тренировки: {counts['workout']}\n"
+        f"📅 Итоги по дням: {counts['total']}\n"
+        f"👤 Профиль: {'да' if counts['profile'] else 'нет'}"
+        + (f"\n⚠ Пропущено нераспознанных строк: {skipped}" if skipped else "")
+    )
+
+@dp.message(ImportData.waiting_file)
+async def import_expects_file(message: Message):
+    await message.answer("📎 Пришлите файл выгрузки документом.")
+
+
 @dp.message(Command("id"))
 async def send_user_id(message: Message):
     await message.answer(f"Твой ID: `{message.from_user.id}`")
@@ -617,19 +823,22 @@ LOW_INTENSITY_WORKOUTS = [
 @dp.message(F.text == "📋 Рекомендации")
 async def get_recommendations(message: Message):
     user_id = message.from_user.id
-    db_date = datetime.now(LOCAL_TZ).strftime("%Y-%m-%d")
-
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute("SELECT SUM(calories) FROM food_logs WHERE user_id = ? AND date = ?", (user_id, db_date)) as food_cursor:
-            food_total = await food_cursor.fetchone()
-        async with db.execute("SELECT calorie_goal FROM users WHERE user_id = ?", (user_id,)) as user_cursor:
-            user_data = await user_cursor.fetchone()
-        async with db.execute("SELECT SUM(calories_burned) FROM workout_logs WHERE user_id = ? AND date = ?", (user_id, db_date)) as workout_cursor:
-            burned_total = await workout_cursor.fetchone()
-
-    calorie_goal = user_data[0] if user_data else 2000
-    food_total = food_total[0] if food_total[0] else 0
-    burned_total = burned_total[0] if burned_total[0] else 0
+    now = datetime.now(LOCAL_TZ)
+    db_date = now.strftime("%Y-%m-%d")
+    day = day_key(now)
+
+    profile = await profile_cache.get(user_id)
+    async with db_pool.read() as db:
+        async with db.execute("SELECT kcal_in, kcal_burned FROM daily_totals WHERE user_id = ? AND day = ?", (user_id, day)) as totals_cursor:
+            totals = await totals_cursor.fetchone()
+        async with db.execute(
+            "SELECT AVG(water_ml), AVG(kcal_burned) FROM daily_totals WHERE user_id = ? AND day >= ? AND day < ?",
+            (user_id, *stats_window(now.date())),
+        ) as avg_cursor:
+            water_avg, burned_avg = await avg_cursor.fetchone()
+
+    calorie_goal = profile.calorie_goal if profile and profile.calorie_goal is not None else 2000
+    food_total, burned_total = totals if totals else (0, 0)
     balance = food_total - burned_total
 
     # рекомендации
@@ -646,12 +855,121 @@ async def get_recommendations(message: Message):
 🏋 Тренировки: {workout_recommendation if workout_recommendation else "✅ Ты хорошо потренировался!"}
 """
 
+    # сравнение с людьми того же возраста и активности за последние 30 дней
+    if profile:
+        peers = []
+        water = await cohort_stats.percentile(profile.age, profile.activity, "water_ml", water_avg)
+        if water:
+            peers.append(f"💧 воды пьёшь больше, чем {water[0]}%")
+        burned = await cohort_stats.percentile(profile.age, profile.activity, "kcal_burned", burned_avg)
+        if burned:
+            peers.append(f"🔥 калорий сжигаешь больше, чем {burned[0]}%")
+        if peers:
+            recommendations_text += "👥 Среди людей твоего возраста и активности ты\n" + "\n".join(peers) + "\n"
+
     await message.answer(recommendations_text)
 
 
+# состояние очередей и кэшей на момент запроса /metrics
+def collect_runtime_metrics():
+    cache_stats = chart_cache.stats()
+    yield from metric_lines("bot_chart_cache_entries", "gauge", "Графики в кэше file_id", [("", [], cache_stats["entries"])])
+    yield from metric_lines("bot_chart_cache_requests_total", "counter", "Обращения к кэшу графиков", [
+        ("", [("result", "hit")], cache_stats["hits"]),
+        ("", [("result", "miss")], cache_stats["misses"]),
+    ])
+    profile_stats = profile_cache.stats()
+    yield from metric_lines("bot_profile_cache_entries", "gauge", "Профили в кэше", [("", [], profile_stats["entries"])])
+    yield from metric_lines("bot_profile_cache_requests_total", "counter", "Обращения к кэшу профилей", [
+        ("", [("result", "hit")], profile_stats["hits"]),
+        ("", [("result", "miss")], profile_stats["misses"]),
+    ])
+    yield from metric_lines("bot_chart_render_pending", "gauge", "Графики в очереди пула процессов", [
+        ("", [], chart_renderer.pending),
+    ])
+    yield from metric_lines("bot_log_writer_pending", "gauge", "Записи логов, ждущие группового коммита", [
+        ("", [], log_writer.pending),
+    ])
+    yield from metric_lines("bot_upstream_circuit_open", "gauge", "Разомкнут ли предохранитель внешнего сервиса", [
+        ("", [("upstream", upstream.name)], int(upstream.state == "open"))
+        for upstream in (WEATHER_UPSTREAM, FOOD_UPSTREAM)
+    ])
+
+REGISTRY.add_collector(collect_runtime_metrics)
+
+loop_watchdog = LoopWatchdog(threshold=LOOP_WATCHDOG_THRESHOLD_MS / 1000) if LOOP_WATCHDOG else None
+if loop_watchdog is not None:
+    REGISTRY.add_collector(loop_watchdog.collect)
+
+async def compact_old_logs():
+    return await compact_logs(db_pool, LOG_RETENTION_DAYS, datetime.now(LOCAL_TZ).date())
+
+scheduler_jobs = default_jobs(REMINDER_TIMES, DIGEST_TIME) if SCHEDULER_ENABLED else []
+if SCHEDULER_ENABLED and LOG_RETENTION_DAYS > 0:
+    scheduler_jobs.append(TaskJob("log_retention", RETENTION_TIME, compact_old_logs))
+
+async def refresh_cohort_stats():
+    await compute_cohort_stats(db_pool, datetime.now(LOCAL_TZ).date())
+    await cohort_stats.load()
+
+if SCHEDULER_ENABLED:
+    scheduler_jobs.append(TaskJob("cohort_stats", STATS_TIME, refresh_cohort_stats))
+
+async def refresh_goals():
+    report = await recompute_goals(db_pool, get_temperature)
+    if report.users_updated:
+        profile_cache.invalidate()
+    return report
+
+if SCHEDULER_ENABLED and GOALS_TIME:
+    scheduler_jobs.append(TaskJob("goals", GOALS_TIME, refresh_goals))
+scheduler = Scheduler(bot, db_pool, LOCAL_TZ, scheduler_jobs)
+
 async def main():
+    if loop_watchdog is not None:
+        loop_watchdog.start()
+    await db_pool.open()
     await init_db()
-    await dp.start_polling(bot)
+    await http_client.start()
+    chart_renderer.start()
+    log_writer.start()
+    scheduler.start()
+    if profile_sync is not None:
+        await profile_sync.start()
+    # профили недавно активных пользователей подгружаются в фоне
+    profile_warm_up = asyncio.create_task(profile_cache.warm(since_day=day_key(datetime.now(LOCAL_TZ) - timedelta(days=7))))
+    # matplotlib грузится в воркерах графиков в фоне, пока бот уже принимает обновления
+    chart_warm_up = asyncio.create_task(chart_renderer.warm_up())
+    # aiohttp.web нужен только для webhook и /metrics — не держим его в импорте модуля
+    from webserver import run_metrics_server, run_webhook
+    metrics_runner = None
+    if METRICS_ENABLED:
+        try:
+            metrics_runner = await run_metrics_server(METRICS_HOST, METRICS_PORT)
+        except OSError as e:
+            # бот работает и без метрик
+            logging.warning("Сервер метрик не запущен на %s:%d: %s", METRICS_HOST, METRICS_PORT, e)
+    try:
+        if WEBHOOK_URL:
+            await run_webhook(dp, bot, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBAPP_HOST, WEBAPP_PORT)
+        else:
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        chart_warm_up.cancel()
+        profile_warm_up.cancel()
+        if profile_sync is not None:
+            await profile_sync.close()
+        await scheduler.close()
+        await log_writer.close()
+        await delivery.close()
+        chart_renderer.close()
+        await http_client.close()
+        await db_pool.close()
+        if loop_watchdog is not None:
+            await loop_watchdog.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
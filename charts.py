@@ -0,0 +1,194 @@
+import asyncio
+import hashlib
+import io
+import logging
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from metrics import CHART_RENDER_SECONDS
+
+# Графики рисуются в отдельных процессах, чтобы не блокировать event loop.
+# Внутри воркеров используется только объектный API matplotlib (Figure + Agg),
+# без глобального состояния pyplot; результат возвращается как PNG в байтах.
+
+
+class ChartQueueFull(Exception):
+    pass
+
+
+def _init_worker():
+    import matplotlib
+    matplotlib.use("Agg")
+    from matplotlib.figure import Figure  # noqa: F401  прогрев импорта
+
+
+def _warm_up():
+    # импорт уже сделан в _init_worker; задача нужна, чтобы пул поднял процесс
+    return None
+
+
+def render_progress_chart(title: str, categories, goal_values, actual_values) -> bytes:
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(6, 4))
+    ax = fig.subplots()
+    bar_width = 0.4
+    x = range(len(categories))
+
+    ax.bar(x, goal_values, width=bar_width, label="Норма", alpha=0.6)
+    ax.bar([i + bar_width for i in x], actual_values, width=bar_width, label="Фактически", alpha=0.8)
+
+    ax.set_xticks([i + bar_width / 2 for i in x])
+    ax.set_xticklabels(categories)
+    ax.set_ylabel("Единицы измерения")
+    ax.set_title(title)
+    ax.legend()
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png")
+    return buffer.getvalue()
+
+
+def render_trend_chart(title: str, labels, water, water_avg, water_goal, kcal, kcal_avg, calorie_goal) -> bytes:
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(8, 5))
+    ax_water = fig.subplots()
+    ax_kcal = ax_water.twinx()
+    x = range(len(labels))
+
+    ax_water.plot(x, water, color="tab:blue", alpha=0.35, label="Вода, мл")
+    ax_water.plot(x, water_avg, color="tab:blue", label="Вода, среднее")
+    ax_water.axhline(water_goal, color="tab:blue", linestyle=":", label="Норма воды")
+    ax_kcal.plot(x, kcal, color="tab:orange", alpha=0.35, label="Калории (съедено − сожжено)")
+    ax_kcal.plot(x, kcal_avg, color="tab:orange", label="Калории, среднее")
+    ax_kcal.axhline(calorie_goal, color="tab:orange", linestyle=":", label="Норма калорий")
+
+    step = max(1, len(labels) // 10)
+    ax_water.set_xticks(list(x)[::step])
+    ax_water.set_xticklabels(labels[::step], rotation=45, ha="right")
+    ax_water.set_ylabel("мл")
+    ax_kcal.set_ylabel("ккал")
+    ax_water.set_title(title)
+
+    lines = ax_water.get_lines() + ax_kcal.get_lines()
+    ax_water.legend(
+        lines, [line.get_label() for line in lines],
+        fontsize="small", loc="upper center", bbox_to_anchor=(0.5, -0.2), ncol=3,
+    )
+    fig.tight_layout()
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png")
+    return buffer.getvalue()
+
+
+class ChartRenderer:
+    def __init__(self, workers: int = 2, max_pending: int = 16):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._pending = 0
+        self._executor = None
+
+    def start(self):
+        if self._executor is None:
+            # forkserver: не форкаем процесс бота вместе с потоками aiosqlite
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("forkserver"),
+                initializer=_init_worker,
+            )
+
+    # Воркеры запускаются по требованию, и первый график ждал бы импорта matplotlib
+    # (и сборки кэша шрифтов). Прогрев поднимает все воркеры заранее, в фоне.
+    async def warm_up(self):
+        self.start()
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        try:
+            await asyncio.gather(*(loop.run_in_executor(self._executor, _warm_up) for _ in range(self.workers)))
+        except Exception:
+            logging.exception("Не удалось прогреть воркеры графиков")
+            return
+        logging.info("Воркеры графиков готовы за %.1f с", loop.time() - started)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    @property
+    def pending(self):
+        return self._pending
+
+    # Очередь ограничена: при переполнении сразу отказываем, а не копим задачи
+    async def render(self, func, *args) -> bytes:
+        if self._pending >= self.max_pending:
+            logging.warning("Очередь графиков переполнена (%d)", self._pending)
+            raise ChartQueueFull()
+
+        self.start()
+        self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            with CHART_RENDER_SECONDS.time(func.__name__):
+                return await loop.run_in_executor(self._executor, func, *args)
+        finally:
+            self._pending -= 1
+
+
+# Кэш уже отправленных графиков: ключ — хэш входных данных графика,
+# значение — file_id, который Telegram вернул при первой загрузке.
+# Повторный запрос с теми же данными отправляется по file_id без рендера и загрузки.
+class ChartCache:
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (file_id, user_id, day)
+        self._keys_by_user = {}  # user_id -> {day: {key, ...}}
+
+    @staticmethod
+    def key(*parts) -> str:
+        return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, user_id: int, day: int, key: str, file_id: str):
+        self._drop(key)
+        self._entries[key] = (file_id, user_id, day)
+        self._keys_by_user.setdefault(user_id, {}).setdefault(day, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
+
+    # day=None — сбросить все дни пользователя (например, после смены профиля)
+    def invalidate(self, user_id: int, day: int = None):
+        days = self._keys_by_user.get(user_id)
+        if not days:
+            return
+        for keys in list(days.values()) if day is None else [days.get(day, ())]:
+            for key in list(keys):
+                self._drop(key)
+
+    def _drop(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        _, user_id, day = entry
+        days = self._keys_by_user[user_id]
+        days[day].discard(key)
+        if not days[day]:
+            del days[day]
+        if not days:
+            del self._keys_by_user[user_id]
+
+    def stats(self):
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,118 @@
+import logging
+import sys
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import date, timedelta
+
+from db import Database, day_key
+
+# Сравнение с «людьми как ты»: пользователи делятся на когорты по возрасту и
+# активности, раз в сутки для каждой когорты строится отсортированное
+# распределение средних за последние WINDOW_DAYS дней (воды и сожжённых калорий).
+# Распределения хранятся в cohort_stats компактно (float32, не больше POINTS
+# квантилей на когорту), а в ответе процентиль находится бинарным поиском.
+
+AGE_BANDS = (25, 35, 45, 55)  # <25, 25–34, 35–44, 45–54, 55+
+ACTIVITY_BANDS = (30, 60, 120, 180)  # те же пороги, что в расчёте нормы калорий
+METRICS = ("water_ml", "kcal_burned")
+WINDOW_DAYS = 30
+MIN_COHORT = 20  # в маленьких когортах процентиль ничего не значит
+POINTS = 1001
+FETCH_SIZE = 50000
+
+
+def cohort_of(age, activity):
+    return bisect_right(AGE_BANDS, age or 0), bisect_right(ACTIVITY_BANDS, activity or 0)
+
+
+# окно — полные дни до сегодняшнего
+def stats_window(today: date):
+    return day_key(today - timedelta(days=WINDOW_DAYS)), day_key(today)
+
+
+async def compute_cohort_stats(database: Database, today: date) -> int:
+    import numpy as np
+
+    start, end = stats_window(today)
+    async with database.read() as db:
+        async with db.execute("SELECT user_id, age, activity FROM users ORDER BY user_id") as cursor:
+            users = np.array(await cursor.fetchall(), dtype=np.float64).reshape(-1, 3)
+        user_ids = users[:, 0].astype(np.int64)
+        sums = np.zeros((len(METRICS), len(user_ids)))
+        days = np.zeros(len(user_ids))
+
+        # итоги по дням читаем пачками и сразу сворачиваем в суммы по пользователям
+        columns = ", ".join(METRICS)
+        async with db.execute(
+            f"SELECT user_id, {columns} FROM daily_totals WHERE day >= ? AND day < ?", (start, end)
+        ) as cursor:
+            while rows := await cursor.fetchmany(FETCH_SIZE):
+                chunk = np.array(rows, dtype=np.float64)
+                index = np.searchsorted(user_ids, chunk[:, 0].astype(np.int64))
+                known = (index < len(user_ids)) & (user_ids[np.minimum(index, len(user_ids) - 1)] == chunk[:, 0])
+                index, chunk = index[known], chunk[known]
+                days += np.bincount(index, minlength=len(user_ids))
+                for i in range(len(METRICS)):
+                    sums[i] += np.bincount(index, weights=chunk[:, i + 1], minlength=len(user_ids))
+
+    active = days > 0
+    averages = np.divide(sums, days, out=np.zeros_like(sums), where=active)
+    age_band = np.searchsorted(AGE_BANDS, np.nan_to_num(users[:, 1]), side="right")
+    activity_band = np.searchsorted(ACTIVITY_BANDS, np.nan_to_num(users[:, 2]), side="right")
+
+    rows = []
+    for a in range(len(AGE_BANDS) + 1):
+        for b in range(len(ACTIVITY_BANDS) + 1):
+            in_cohort = active & (age_band == a) & (activity_band == b)
+            for i, metric in enumerate(METRICS):
+                # кто эту величину совсем не записывает, в сравнении не участвует
+                values = np.sort(averages[i][in_cohort & (averages[i] > 0)])
+                if len(values) < MIN_COHORT:
+                    continue
+                if len(values) > POINTS:
+                    values = np.quantile(values, np.linspace(0, 1, POINTS))
+                rows.append((a, b, metric, int(in_cohort.sum()), values.astype("<f4").tobytes(), day_key(today)))
+
+    async with database.write() as db:
+        await db.execute("DELETE FROM cohort_stats")
+        await db.executemany(
+            "INSERT INTO cohort_stats (age_band, activity_band, metric, users, points, computed_day) VALUES (?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+    logging.info("Статистика когорт пересчитана: %d распределений, %d пользователей", len(rows), int(active.sum()))
+    return len(rows)
+
+
+def _points(blob: bytes) -> array:
+    points = array("f")
+    points.frombytes(blob)
+    if sys.byteorder == "big":
+        points.byteswap()
+    return points
+
+
+# Распределения в памяти процесса; перечитываются из базы раз в reload_interval
+class CohortStats:
+    def __init__(self, database: Database, reload_interval: float = 3600):
+        self.database = database
+        self.reload_interval = reload_interval
+        self._points = {}
+        self._loaded_at = None
+
+    async def load(self):
+        async with self.database.read() as db:
+            async with db.execute("SELECT age_band, activity_band, metric, users, points FROM cohort_stats") as cursor:
+                rows = await cursor.fetchall()
+        self._points = {(a, b, metric): (users, _points(blob)) for a, b, metric, users, blob in rows}
+        self._loaded_at = time.monotonic()
+
+    # Доля людей из когорты (в процентах), у которых значение меньше value, и размер когорты
+    async def percentile(self, age, activity, metric: str, value: float):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at >= self.reload_interval:
+            await self.load()
+        entry = self._points.get((*cohort_of(age, activity), metric))
+        if entry is None or not value:
+            return None
+        users, points = entry
+        return round(bisect_left(points, value) / len(points) * 100), users
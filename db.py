@@ -0,0 +1,496 @@
+import argparse
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+import aiosqlite
+
+from metrics import DB_SECONDS
+
+# Пул соединений с SQLite: одно соединение на запись и несколько на чтение.
+# Соединения открываются один раз при старте бота и живут до выключения.
+
+CACHE_SIZE_KIB = 16384  # ~16 МБ page cache на соединение
+
+
+class Database:
+    def __init__(self, path: str, readers: int = 2):
+        self.path = path
+        self.readers_count = readers
+        self._writer = None
+        self._write_lock = asyncio.Lock()
+        self._readers = asyncio.Queue()
+        self._all_readers = []
+
+    async def _connect(self, read_only=False):
+        conn = await aiosqlite.connect(self.path)
+        await conn.executescript(
+            "PRAGMA busy_timeout=5000;"
+            "PRAGMA synchronous=NORMAL;"
+            f"PRAGMA cache_size=-{CACHE_SIZE_KIB};"
+            + ("PRAGMA query_only=1;" if read_only else "")
+        )
+        return conn
+
+    async def open(self):
+        if self._writer is not None:
+            return
+        try:
+            self._writer = await self._connect()
+            # новая база создаётся с постраничным освобождением места (см. retention.py);
+            # действует, только пока в базе нет ни одной таблицы, у существующей базы режим меняет лишь полный VACUUM
+            await self._writer.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            # WAL хранится в файле БД, достаточно включить один раз на писателе
+            async with self._writer.execute("PRAGMA journal_mode=WAL") as cursor:
+                await cursor.fetchone()
+            for _ in range(self.readers_count):
+                conn = await self._connect(read_only=True)
+                self._all_readers.append(conn)
+                self._readers.put_nowait(conn)
+        except Exception:
+            await self.close()
+            raise
+        logging.info("БД %s открыта: 1 писатель, %d читателей", self.path, self.readers_count)
+
+    async def close(self):
+        for conn in self._all_readers:
+            await conn.close()
+        self._all_readers.clear()
+        self._readers = asyncio.Queue()
+        if self._writer is not None:
+            await self._writer.close()
+            self._writer = None
+
+    def _check_open(self):
+        # без open() очередь читателей пуста, и read() ждал бы вечно
+        if self._writer is None:
+            raise RuntimeError(f"БД {self.path} не открыта: сначала вызовите Database.open()")
+
+    @asynccontextmanager
+    async def read(self):
+        self._check_open()
+        with DB_SECONDS.time("read", "wait"):
+            conn = await self._readers.get()
+        try:
+            with DB_SECONDS.time("read", "query"):
+                yield conn
+        finally:
+            self._readers.put_nowait(conn)
+
+    # Запись сериализуется через один писатель: коммит при выходе, откат при ошибке
+    @asynccontextmanager
+    async def write(self):
+        self._check_open()
+        with DB_SECONDS.time("write", "wait"):
+            await self._write_lock.acquire()
+        try:
+            with DB_SECONDS.time("write", "query"):
+                try:
+                    yield self._writer
+                except BaseException:
+                    await self._writer.rollback()
+                    raise
+                await self._writer.commit()
+        finally:
+            self._write_lock.release()
+
+
+# Групповая запись логов: вставки из всех обработчиков копятся несколько
+# миллисекунд (или до max_batch штук) и коммитятся одной транзакцией.
+# Вызывающий ждёт коммита своей строки и может в той же транзакции сразу
+# прочитать свои итоги (query), так что видит собственную запись.
+class LogWriter:
+    def __init__(self, database: Database, max_batch: int = 200, max_delay: float = 0.005):
+        self.database = database
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = asyncio.Queue()
+        self._task = None
+        self._closed = False
+
+    def start(self):
+        if self._task is None:
+            self._closed = False
+            self._task = asyncio.create_task(self._run())
+
+    @property
+    def pending(self):
+        return self._queue.qsize()
+
+    async def close(self):
+        # всё, что попало в очередь до остановки, будет записано
+        if self._task is not None:
+            self._closed = True
+            self._queue.put_nowait(None)
+            await self._task
+            self._task = None
+
+    async def write(self, sql: str, params, query: str = None, query_params=()):
+        return await self._submit(sql, params, query, query_params, False)
+
+    # Несколько строк одним executemany — все в одной транзакции вместе с query
+    async def write_many(self, sql: str, rows, query: str = None, query_params=()):
+        return await self._submit(sql, rows, query, query_params, True)
+
+    async def _submit(self, sql, params, query, query_params, many):
+        if self._closed:
+            async with self.database.write() as db:
+                return await self._execute(db, (sql, params, query, query_params, many, None))
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((sql, params, query, query_params, many, future))
+        return await future
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            if self._queue.qsize() < self.max_batch:
+                await asyncio.sleep(self.max_delay)
+
+            batch = [item]
+            while len(batch) < self.max_batch and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+    @staticmethod
+    async def _execute(db, item):
+        sql, params, query, query_params, many, _ = item
+        if many:
+            await db.executemany(sql, params)
+        else:
+            await db.execute(sql, params)
+        if query is None:
+            return None
+        async with db.execute(query, query_params) as cursor:
+            return await cursor.fetchone()
+
+    async def _flush(self, batch):
+        try:
+            async with self.database.write() as db:
+                results = [await self._execute(db, item) for item in batch]
+        except Exception:
+            # одна плохая строка не должна ронять всю пачку — пишем по одной
+            logging.exception("Ошибка групповой записи, повтор по одной строке")
+            for item in batch:
+                future = item[-1]
+                try:
+                    async with self.database.write() as db:
+                        result = await self._execute(db, item)
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    if not future.done():
+                        future.set_result(result)
+            return
+
+        for item, result in zip(batch, results):
+            future = item[-1]
+            if not future.done():
+                future.set_result(result)
+
+
+# Ключ дня для логов: целое YYYYMMDD, сравнивается и сортируется как дата
+def day_key(d) -> int:
+    return d.year * 10000 + d.month * 100 + d.day
+
+
+# Итоги по дням, посчитанные заново по сырым логам
+TOTALS_FROM_LOGS_SQL = """
+    SELECT user_id, day, SUM(water_ml) AS water_ml, SUM(kcal_in) AS kcal_in, SUM(kcal_burned) AS kcal_burned FROM (
+        SELECT user_id, day, COALESCE(amount, 0) AS water_ml, 0 AS kcal_in, 0 AS kcal_burned FROM water_logs
+        UNION ALL
+        SELECT user_id, day, 0, COALESCE(calories, 0), 0 FROM food_logs
+        UNION ALL
+        SELECT user_id, day, 0, 0, COALESCE(calories_burned, 0) FROM workout_logs
+    )
+    WHERE day IS NOT NULL
+    GROUP BY user_id, day
+"""
+
+
+# Исходная схема (версия 0), поверх неё применяются миграции
+BASE_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        weight INTEGER,
+        height INTEGER,
+        age INTEGER,
+        activity INTEGER,
+        city TEXT,
+        calorie_goal INTEGER,
+        water_goal INTEGER
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS water_logs (
+        user_id INTEGER,
+        date TEXT,
+        amount INTEGER
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS food_logs (
+        user_id INTEGER,
+        date TEXT,
+        food_name TEXT,
+        calories REAL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS workout_logs (
+        user_id INTEGER,
+        date TEXT,
+        workout_type TEXT,
+        duration INTEGER,
+        calories_burned INTEGER
+    )
+    """,
+]
+
+
+# Миграции схемы. Номер текущей версии хранится в PRAGMA user_version,
+# каждая миграция применяется в отдельной транзакции.
+MIGRATIONS = [
+    # 1: целочисленный день + составные индексы (user_id, day)
+    [
+        "ALTER TABLE water_logs ADD COLUMN day INTEGER",
+        "ALTER TABLE food_logs ADD COLUMN day INTEGER",
+        "ALTER TABLE workout_logs ADD COLUMN day INTEGER",
+        "UPDATE water_logs SET day = CAST(strftime('%Y%m%d', date) AS INTEGER)",
+        "UPDATE food_logs SET day = CAST(strftime('%Y%m%d', date) AS INTEGER)",
+        "UPDATE workout_logs SET day = CAST(strftime('%Y%m%d', date) AS INTEGER)",
+        "CREATE INDEX IF NOT EXISTS idx_water_logs_user_day ON water_logs (user_id, day)",
+        "CREATE INDEX IF NOT EXISTS idx_food_logs_user_day ON food_logs (user_id, day)",
+        "CREATE INDEX IF NOT EXISTS idx_workout_logs_user_day ON workout_logs (user_id, day)",
+    ],
+    # 2: дневные итоги, обновляются триггерами в той же транзакции, что и вставка в лог
+    [
+        """
+        CREATE TABLE IF NOT EXISTS daily_totals (
+            user_id INTEGER NOT NULL,
+            day INTEGER NOT NULL,
+            water_ml INTEGER NOT NULL DEFAULT 0,
+            kcal_in REAL NOT NULL DEFAULT 0,
+            kcal_burned INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day)
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_water_logs_totals AFTER INSERT ON water_logs
+        BEGIN
+            INSERT INTO daily_totals (user_id, day, water_ml) VALUES (NEW.user_id, NEW.day, COALESCE(NEW.amount, 0))
+            ON CONFLICT (user_id, day) DO UPDATE SET water_ml = water_ml + excluded.water_ml;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_food_logs_totals AFTER INSERT ON food_logs
+        BEGIN
+            INSERT INTO daily_totals (user_id, day, kcal_in) VALUES (NEW.user_id, NEW.day, COALESCE(NEW.calories, 0))
+            ON CONFLICT (user_id, day) DO UPDATE SET kcal_in = kcal_in + excluded.kcal_in;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_workout_logs_totals AFTER INSERT ON workout_logs
+        BEGIN
+            INSERT INTO daily_totals (user_id, day, kcal_burned) VALUES (NEW.user_id, NEW.day, COALESCE(NEW.calories_burned, 0))
+            ON CONFLICT (user_id, day) DO UPDATE SET kcal_burned = kcal_burned + excluded.kcal_burned;
+        END
+        """,
+        "INSERT INTO daily_totals (user_id, day, water_ml, kcal_in, kcal_burned) " + TOTALS_FROM_LOGS_SQL,
+    ],
+    # 3: локальный каталог продуктов + полнотекстовый индекс FTS5 по названию
+    [
+        """
+        CREATE TABLE IF NOT EXISTS food_catalog (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE COLLATE NOCASE,
+            kcal_100g REAL NOT NULL
+        )
+        """,
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS food_catalog_fts USING fts5(
+            name, content='food_catalog', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_food_catalog_ai AFTER INSERT ON food_catalog
+        BEGIN
+            INSERT INTO food_catalog_fts (rowid, name) VALUES (NEW.id, NEW.name);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_food_catalog_ad AFTER DELETE ON food_catalog
+        BEGIN
+            INSERT INTO food_catalog_fts (food_catalog_fts, rowid, name) VALUES ('delete', OLD.id, OLD.name);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_food_catalog_au AFTER UPDATE ON food_catalog
+        BEGIN
+            INSERT INTO food_catalog_fts (food_catalog_fts, rowid, name) VALUES ('delete', OLD.id, OLD.name);
+            INSERT INTO food_catalog_fts (rowid, name) VALUES (NEW.id, NEW.name);
+        END
+        """,
+    ],
+    # 4: состояния FSM (диалоги) переживают перезапуск и общие для нескольких процессов
+    [
+        """
+        CREATE TABLE IF NOT EXISTS fsm_storage (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL DEFAULT '{}',
+            updated_at INTEGER NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_fsm_storage_updated_at ON fsm_storage (updated_at)",
+    ],
+    # 5: последний запуск плановых задач — чтобы не повторять рассылку после
+    # перезапуска и не дублировать её из нескольких процессов
+    [
+        """
+        CREATE TABLE IF NOT EXISTS scheduler_runs (
+            job TEXT PRIMARY KEY,
+            last_day INTEGER NOT NULL
+        )
+        """,
+    ],
+    # 6: граница компактификации логов: сырые строки за дни раньше compacted_before
+    # удалены, за эти дни остались только итоги в daily_totals
+    [
+        """
+        CREATE TABLE IF NOT EXISTS log_retention (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            compacted_before INTEGER NOT NULL
+        )
+        """,
+        "INSERT OR IGNORE INTO log_retention (id, compacted_before) VALUES (1, 0)",
+    ],
+    # 7: распределения по когортам (возраст × активность), пересчитываются раз в сутки;
+    # points — отсортированные значения или квантили, float32 little-endian
+    [
+        """
+        CREATE TABLE IF NOT EXISTS cohort_stats (
+            age_band INTEGER NOT NULL,
+            activity_band INTEGER NOT NULL,
+            metric TEXT NOT NULL,
+            users INTEGER NOT NULL,
+            points BLOB NOT NULL,
+            computed_day INTEGER NOT NULL,
+            PRIMARY KEY (age_band, activity_band, metric)
+        ) WITHOUT ROWID
+        """,
+    ],
+]
+
+
+async def migrate(conn):
+    async with conn.execute("PRAGMA user_version") as cursor:
+        (version,) = await cursor.fetchone()
+
+    if version == 0:
+        for sql in BASE_SCHEMA:
+            await conn.execute(sql)
+
+    for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+        await conn.commit()
+        await conn.execute("BEGIN")
+        try:
+            for sql in statements:
+                await conn.execute(sql)
+            await conn.execute(f"PRAGMA user_version = {number}")
+        except Exception:
+            await conn.rollback()
+            raise
+        await conn.commit()
+        logging.info("Миграция схемы %d применена", number)
+
+
+# Первый день, за который ещё хранятся сырые логи; более ранние дни есть только в daily_totals
+async def compacted_before(conn) -> int:
+    async with conn.execute("SELECT compacted_before FROM log_retention") as cursor:
+        row = await cursor.fetchone()
+    return row[0] if row else 0
+
+
+# Пары (user_id, day), у которых daily_totals разошлись с сырыми логами.
+# Сравниваются дни [start, end); по умолчанию — все, для которых логи ещё не компактифицированы.
+# Дни без сырых логов не проверяются: такие итоги законны (загружены через /import
+# из чужой компактифицированной истории), и «исправить» их можно только удалением.
+async def check_daily_totals(conn, start: int = None, end: int = 99991231):
+    if start is None:
+        start = await compacted_before(conn)
+    sql = f"""
+        SELECT user_id, day FROM (
+            SELECT user_id, day, water_ml, ROUND(kcal_in, 2), ROUND(kcal_burned, 2) FROM ({TOTALS_FROM_LOGS_SQL})
+            WHERE day >= :start AND day < :end
+            EXCEPT
+            SELECT user_id, day, water_ml, ROUND(kcal_in, 2), ROUND(kcal_burned, 2) FROM daily_totals
+            WHERE day >= :start AND day < :end
+        )
+        ORDER BY user_id, day
+    """
+    async with conn.execute(sql, {"start": start, "end": end}) as cursor:
+        return await cursor.fetchall()
+
+
+# Пересчёт по логам; компактифицированные дни и дни без логов не трогаем — считать их не из чего
+async def rebuild_daily_totals(conn):
+    start = await compacted_before(conn)
+    await conn.execute(
+        f"INSERT OR REPLACE INTO daily_totals (user_id, day, water_ml, kcal_in, kcal_burned) SELECT * FROM ({TOTALS_FROM_LOGS_SQL}) WHERE day >= ?",
+        (start,),
+    )
+
+
+# Пересчёт итогов одного дня пользователя по индексу (user_id, day)
+async def recompute_daily_total(conn, user_id: int, day: int):
+    await conn.execute("DELETE FROM daily_totals WHERE user_id = ? AND day = ?", (user_id, day))
+    await conn.execute("""
+        INSERT INTO daily_totals (user_id, day, water_ml, kcal_in, kcal_burned)
+        SELECT :user_id, :day, water_ml, kcal_in, kcal_burned FROM (
+            SELECT SUM(water_ml) AS water_ml, SUM(kcal_in) AS kcal_in, SUM(kcal_burned) AS kcal_burned, COUNT(*) AS logs FROM (
+                SELECT COALESCE(amount, 0) AS water_ml, 0 AS kcal_in, 0 AS kcal_burned FROM water_logs WHERE user_id = :user_id AND day = :day
+                UNION ALL
+                SELECT 0, COALESCE(calories, 0), 0 FROM food_logs WHERE user_id = :user_id AND day = :day
+                UNION ALL
+                SELECT 0, 0, COALESCE(calories_burned, 0) FROM workout_logs WHERE user_id = :user_id AND day = :day
+            )
+        )
+        WHERE logs > 0
+    """, {"user_id": user_id, "day": day})
+
+
+# Обслуживание: python db.py check-totals [--fix]
+async def _cli(args):
+    database = Database(args.db, readers=0)
+    await database.open()
+    try:
+        async with database.write() as conn:
+            await migrate(conn)
+            drift = await check_daily_totals(conn)
+            for user_id, day in drift:
+                print(f"расхождение: user_id={user_id} day={day}")
+            print(f"Расхождений в daily_totals: {len(drift)}")
+            if drift and args.fix:
+                await rebuild_daily_totals(conn)
+                print("daily_totals пересчитана по логам")
+    finally:
+        await database.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Обслуживание базы бота")
+    parser.add_argument("command", choices=["check-totals"])
+    parser.add_argument("--db", default="bot_database.db")
+    parser.add_argument("--fix", action="store_true", help="пересчитать daily_totals при расхождениях")
+    asyncio.run(_cli(parser.parse_args()))
@@ -0,0 +1,161 @@
+import asyncio
+import contextvars
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+from metrics import DELIVERY_QUEUED, DELIVERY_RETRY_AFTER, DELIVERY_SECONDS
+
+# Исходящие сообщения с учётом лимитов Telegram.
+# Подключается как middleware сессии бота, поэтому через неё проходят все
+# message.answer / answer_photo и т.п. без изменений в обработчиках.
+# - в каждый чат не чаще chat_rate сообщений в секунду (с запасом chat_burst);
+# - всего не больше global_rate сообщений в секунду;
+# - глобальные «слоты» раздаются по приоритету: ответы пользователям раньше рассылок;
+# - на 429 (RetryAfter) чат ставится на паузу и сообщение отправляется повторно.
+
+INTERACTIVE = 0
+BULK = 1
+LANES = {INTERACTIVE: "interactive", BULK: "bulk"}
+
+_priority = contextvars.ContextVar("delivery_priority", default=INTERACTIVE)
+
+
+# Массовые рассылки (напоминания, сводки) оборачиваются в with bulk_delivery():
+@contextmanager
+def bulk_delivery():
+    token = _priority.set(BULK)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # сколько ждать до появления токена (0 — можно сейчас)
+    def delay(self) -> float:
+        now = time.monotonic()
+        self._refill(now)
+        wait = max(0.0, self.paused_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds: float):
+        self.paused_until = time.monotonic() + seconds
+        self.tokens = 0
+
+    @property
+    def idle(self):
+        return not self.lock.locked() and self.delay() == 0 and self.tokens >= self.capacity
+
+
+class Delivery(BaseRequestMiddleware):
+    def __init__(self, global_rate: float = 30, chat_rate: float = 1, chat_burst: float = 3,
+                 max_retries: int = 3, max_chats: int = 10000):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self._chats = {}
+        self._queue = asyncio.PriorityQueue()
+        self._order = itertools.count()
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await make_request(bot, method)
+
+        self.start()
+        priority = _priority.get()
+        lane = LANES[priority]
+        started = time.monotonic()
+
+        for attempt in range(self.max_retries + 1):
+            DELIVERY_QUEUED.inc(lane)
+            try:
+                await self._wait_chat(chat_id)
+                await self._wait_global(priority)
+            finally:
+                DELIVERY_QUEUED.dec(lane)
+
+            try:
+                result = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                DELIVERY_RETRY_AFTER.inc()
+                logging.warning("Telegram RetryAfter %s с для чата %s", e.retry_after, chat_id)
+                self._chat_bucket(chat_id).pause(e.retry_after)
+                if attempt == self.max_retries:
+                    raise
+                continue
+
+            DELIVERY_SECONDS.observe(time.monotonic() - started, lane)
+            return result
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.max_chats:
+                # забываем чаты, у которых корзина уже полная — для них ничего не меняется
+                for key in [key for key, b in self._chats.items() if b.idle]:
+                    del self._chats[key]
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def _wait_chat(self, chat_id):
+        # лимит чата ждём до общей очереди, чтобы один «болтливый» чат не задерживал остальных
+        bucket = self._chat_bucket(chat_id)
+        async with bucket.lock:
+            while (delay := bucket.delay()) > 0:
+                await asyncio.sleep(delay)
+            bucket.take()
+
+    async def _wait_global(self, priority: int):
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((priority, next(self._order), future))
+        await future
+
+    async def _run(self):
+        while True:
+            _, _, future = await self._queue.get()
+            if future.done():
+                continue
+            while (delay := self.global_bucket.delay()) > 0:
+                await asyncio.sleep(delay)
+            if not future.done():
+                self.global_bucket.take()
+                future.set_result(None)
@@ -0,0 +1,163 @@
+import argparse
+import asyncio
+import csv
+import gzip
+import json
+import re
+import sys
+
+from db import Database, migrate
+
+# Локальный каталог продуктов (название + ккал на 100 г) с полнотекстовым поиском.
+# Наполняется из дампа OpenFoodFacts (CSV или JSONL, можно .gz) и ответами API.
+
+IMPORT_BATCH = 5000
+MAX_KCAL_100G = 1000  # больше не бывает даже у чистого жира — мусор в дампе
+# совпадение не по всем словам принимается, если найдено не меньше этой доли слов
+MIN_OR_COVERAGE = 0.75
+OR_CANDIDATES = 20
+
+
+def _terms(text: str):
+    # у длинных слов отрезаем окончание, чтобы «гречки» находило «гречка»
+    return [w[:-1] if len(w) > 4 else w for w in re.findall(r"\w+", text.lower())]
+
+
+def _match_query(text: str, any_word=False):
+    # префиксный поиск по каждому слову
+    terms = [f'"{term}"*' for term in _terms(text)]
+    return (" OR " if any_word else " ").join(terms)
+
+
+# доля слов запроса, найденных в названии продукта
+def _coverage(terms, name: str) -> float:
+    words = re.findall(r"\w+", name.lower())
+    return sum(any(word.startswith(term) for word in words) for term in terms) / len(terms)
+
+
+async def _search(db, match: str, limit: int):
+    async with db.execute("""
+        SELECT c.name, c.kcal_100g
+        FROM food_catalog_fts f
+        JOIN food_catalog c ON c.id = f.rowid
+        WHERE food_catalog_fts MATCH ?
+        ORDER BY f.rank, length(c.name)
+        LIMIT ?
+    """, (match, limit)) as cursor:
+        return await cursor.fetchall()
+
+
+async def search_food(db, product_name: str):
+    query = _match_query(product_name)
+    if not query:
+        return None
+
+    # сначала все слова сразу
+    rows = await _search(db, query, 1)
+    if not rows:
+        # потом хотя бы одно, но только если совпала большая часть слов: иначе
+        # «куриный суп» нашёл бы любой «суп …», а лучше спросить OpenFoodFacts
+        terms = _terms(product_name)
+        rows = [row for row in await _search(db, _match_query(product_name, any_word=True), OR_CANDIDATES)
+                if _coverage(terms, row[0]) >= MIN_OR_COVERAGE][:1]
+    if rows:
+        return {"name": rows[0][0], "calories": rows[0][1]}
+    return None
+
+
+# Ответ API в каталог: без названия или без правдоподобной калорийности не сохраняем —
+# иначе ноль ккал навсегда закрыл бы этому продукту дорогу к OpenFoodFacts
+async def add_food(db, name: str, kcal_100g) -> bool:
+    name = " ".join((name or "").split())
+    kcal = _parse_kcal(kcal_100g)
+    if not name or kcal is None:
+        return False
+    await db.execute("INSERT OR IGNORE INTO food_catalog (name, kcal_100g) VALUES (?, ?)", (name, kcal))
+    return True
+
+
+def _parse_kcal(value):
+    try:
+        kcal = float(value)
+    except (TypeError, ValueError):
+        return None
+    return kcal if 0 <= kcal <= MAX_KCAL_100G else None
+
+
+def _read_csv(stream):
+    csv.field_size_limit(sys.maxsize)
+    for row in csv.DictReader(stream, delimiter="\t"):
+        kcal = _parse_kcal(row.get("energy-kcal_100g"))
+        if kcal is None:
+            # в части записей есть только энергия в кДж
+            try:
+                kcal = _parse_kcal(round(float(row.get("energy_100g")) / 4.184, 1))
+            except (TypeError, ValueError):
+                pass
+        yield row.get("product_name"), kcal
+
+
+def _read_jsonl(stream):
+    for line in stream:
+        try:
+            product = json.loads(line)
+        except ValueError:
+            continue
+        name = product.get("product_name_ru") or product.get("product_name")
+        yield name, _parse_kcal(product.get("nutriments", {}).get("energy-kcal_100g"))
+
+
+def read_dump(path: str, fmt: str = None):
+    opener = gzip.open if path.endswith(".gz") else open
+    fmt = fmt or ("jsonl" if ".json" in path else "csv")
+    with opener(path, "rt", encoding="utf-8", errors="replace", newline="") as stream:
+        reader = _read_jsonl if fmt == "jsonl" else _read_csv
+        for name, kcal in reader(stream):
+            name = " ".join((name or "").split())
+            if name and kcal is not None:
+                yield name, kcal
+
+
+async def import_dump(database: Database, path: str, fmt: str = None):
+    total = 0
+    batch = []
+
+    async def flush():
+        async with database.write() as db:
+            await db.executemany("INSERT OR IGNORE INTO food_catalog (name, kcal_100g) VALUES (?, ?)", batch)
+        batch.clear()
+
+    # файл читается построчно, в памяти не больше одной пачки строк
+    for item in read_dump(path, fmt):
+        batch.append(item)
+        total += 1
+        if len(batch) >= IMPORT_BATCH:
+            await flush()
+    if batch:
+        await flush()
+
+    async with database.write() as db:
+        await db.execute("INSERT INTO food_catalog_fts (food_catalog_fts) VALUES ('optimize')")
+    return total
+
+
+# Импорт дампа: python food_catalog.py import products.csv.gz [--db ...]
+async def _cli(args):
+    database = Database(args.db, readers=0)
+    await database.open()
+    try:
+        async with database.write() as db:
+            await migrate(db)
+        total = await import_dump(database, args.path, args.format)
+        print(f"Прочитано продуктов: {total}")
+    finally:
+        await database.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Локальный каталог продуктов")
+    parser.add_argument("command", choices=["import"])
+    parser.add_argument("path", help="дамп OpenFoodFacts: CSV (TSV) или JSONL, можно .gz")
+    parser.add_argument("--format", choices=["csv", "jsonl"])
+    parser.add_argument("--db", default="bot_database.db")
+    asyncio.run(_cli(parser.parse_args()))
@@ -0,0 +1,116 @@
+import json
+import time
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from db import Database
+
+# Хранилища состояний FSM. По умолчанию — таблица fsm_storage в базе бота,
+# так что незаконченные диалоги переживают перезапуск. Для нескольких
+# процессов на разных машинах — Redis (любой сервер с протоколом Redis).
+# Брошенные диалоги истекают через ttl секунд.
+
+FSM_STORAGES = ("memory", "sqlite", "redis")
+
+
+def _state_name(state):
+    return state.state if isinstance(state, State) else state
+
+
+class SQLiteStorage(BaseStorage):
+    def __init__(self, database: Database, ttl: int = 86400, purge_interval: int = 600):
+        self.database = database
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self._last_purge = 0
+
+    @staticmethod
+    def _key(key: StorageKey):
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.business_connection_id or ''}:{key.destiny}"
+
+    async def _read(self, key: StorageKey):
+        async with self.database.read() as db:
+            async with db.execute(
+                "SELECT state, data FROM fsm_storage WHERE key = ? AND updated_at >= ?",
+                (self._key(key), int(time.time()) - self.ttl),
+            ) as cursor:
+                return await cursor.fetchone()
+
+    async def _purge(self, db, now: int):
+        if now - self._last_purge >= self.purge_interval:
+            self._last_purge = now
+            await db.execute("DELETE FROM fsm_storage WHERE updated_at < ?", (now - self.ttl,))
+
+    async def set_state(self, key: StorageKey, state=None):
+        now = int(time.time())
+        async with self.database.write() as db:
+            # данные истёкшего диалога не воскрешаем вместе с новым состоянием
+            await db.execute("""
+                INSERT INTO fsm_storage (key, state, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET
+                    state = excluded.state,
+                    data = CASE WHEN updated_at < ? THEN '{}' ELSE data END,
+                    updated_at = excluded.updated_at
+            """, (self._key(key), _state_name(state), now, now - self.ttl))
+            # пустые записи не храним
+            await db.execute("DELETE FROM fsm_storage WHERE key = ? AND state IS NULL AND data = '{}'", (self._key(key),))
+            await self._purge(db, now)
+
+    async def get_state(self, key: StorageKey):
+        row = await self._read(key)
+        return row[0] if row else None
+
+    async def set_data(self, key: StorageKey, data):
+        now = int(time.time())
+        async with self.database.write() as db:
+            await self._write_data(db, key, data, now)
+            await self._purge(db, now)
+
+    async def _write_data(self, db, key: StorageKey, data, now: int):
+        if not data:
+            await db.execute("UPDATE fsm_storage SET data = '{}', updated_at = ? WHERE key = ?", (now, self._key(key)))
+            await db.execute("DELETE FROM fsm_storage WHERE key = ? AND state IS NULL", (self._key(key),))
+            return
+        await db.execute("""
+            INSERT INTO fsm_storage (key, data, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET
+                state = CASE WHEN updated_at < ? THEN NULL ELSE state END,
+                data = excluded.data,
+                updated_at = excluded.updated_at
+        """, (self._key(key), json.dumps(data, ensure_ascii=False), now, now - self.ttl))
+
+    async def get_data(self, key: StorageKey):
+        row = await self._read(key)
+        return json.loads(row[1]) if row else {}
+
+    # чтение и запись в одной транзакции писателя, без гонки между get_data и set_data
+    async def update_data(self, key: StorageKey, data):
+        now = int(time.time())
+        async with self.database.write() as db:
+            async with db.execute(
+                "SELECT data FROM fsm_storage WHERE key = ? AND updated_at >= ?",
+                (self._key(key), now - self.ttl),
+            ) as cursor:
+                row = await cursor.fetchone()
+            current = json.loads(row[0]) if row else {}
+            current.update(data)
+            await self._write_data(db, key, current, now)
+        return current.copy()
+
+    async def close(self):
+        # соединения принадлежат пулу базы, он закрывается в main()
+        pass
+
+
+def create_storage(kind: str, database: Database, redis_url: str = None, ttl: int = 86400):
+    if kind == "memory":
+        return MemoryStorage()
+    if kind == "sqlite":
+        return SQLiteStorage(database, ttl=ttl)
+    if kind == "redis":
+        # redis нужен только для этого варианта, поэтому импортируем здесь
+        from aiogram.fsm.storage.redis import RedisStorage
+        return RedisStorage.from_url(redis_url or "redis://localhost:6379/0", state_ttl=ttl, data_ttl=ttl)
+    raise ValueError(f"Неизвестное хранилище FSM: {kind}, доступны: {', '.join(FSM_STORAGES)}")
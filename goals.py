@@ -0,0 +1,129 @@
+import asyncio
+import logging
+from typing import NamedTuple
+
+from db import Database
+
+# Дневные нормы воды и калорий. Одни и те же формулы используются при заполнении
+# профиля (goals_for — для одного пользователя) и в периодическом пересчёте
+# (recompute_goals — для всех сразу: одна погода на город, расчёт массивами NumPy,
+# запись пачками), чтобы норма воды следовала за погодой, а не за днём регистрации.
+
+MAX_WATER_GOAL = 4000
+DEFAULT_TEMPERATURE = 20  # если погода недоступна
+# (верхняя граница минут активности, коэффициент к основному обмену)
+ACTIVITY_FACTORS = (
+    (30, 1.2),  # Малоподвижный образ жизни
+    (60, 1.375),  # Лёгкая активность
+    (120, 1.55),  # Средняя активность
+    (180, 1.725),  # Высокая активность
+)
+MAX_ACTIVITY_FACTOR = 1.9  # Очень активный образ жизни
+
+
+def water_goal_for(weight, activity, temp):
+    water_goal = weight * 25
+    water_goal += (activity // 30) * 150  # +150 мл за каждые 30 мин активности
+
+    if temp > 25:
+        water_goal += 250  # Жара больше воды
+    elif temp < 0:
+        water_goal -= 200  # Мороз меньше воды
+
+    return round(min(water_goal, MAX_WATER_GOAL), 2)
+
+
+def calorie_goal_for(weight, height, age, activity):
+    bmr = (10 * weight) + (6.25 * height) - (5 * age) + 5  # Основной обмен
+    factor = next((f for limit, f in ACTIVITY_FACTORS if activity < limit), MAX_ACTIVITY_FACTOR)
+    return round(bmr * factor, 2)
+
+
+# (calorie_goal, water_goal)
+def goals_for(weight, height, age, activity, temp):
+    return calorie_goal_for(weight, height, age, activity), water_goal_for(weight, activity, temp)
+
+
+# То же для массивов: по элементу на пользователя
+def goals_for_arrays(weight, height, age, activity, temp):
+    import numpy as np
+
+    water = weight * 25 + (activity // 30) * 150
+    water = water + np.where(temp > 25, 250, np.where(temp < 0, -200, 0))
+    water = np.round(np.minimum(water, MAX_WATER_GOAL), 2)
+
+    bmr = (10 * weight) + (6.25 * height) - (5 * age) + 5
+    limits = np.array([limit for limit, _ in ACTIVITY_FACTORS])
+    factors = np.array([f for _, f in ACTIVITY_FACTORS] + [MAX_ACTIVITY_FACTOR])
+    calories = np.round(bmr * factors[np.searchsorted(limits, activity, side="right")], 2)
+    return calories, water
+
+
+class GoalsReport(NamedTuple):
+    cities: int
+    cities_without_weather: int
+    users_checked: int
+    users_updated: int
+
+
+PROFILE_SQL = """
+    SELECT user_id, weight, height, age, activity, city, calorie_goal, water_goal FROM users
+    WHERE user_id > ? AND city IS NOT NULL AND weight IS NOT NULL AND height IS NOT NULL
+        AND age IS NOT NULL AND activity IS NOT NULL
+    ORDER BY user_id LIMIT ?
+"""
+# профиль мог смениться между чтением и записью — тогда set_city уже записал свежие нормы
+UPDATE_SQL = """
+    UPDATE users SET calorie_goal = ?, water_goal = ?
+    WHERE user_id = ? AND weight = ? AND height = ? AND age = ? AND activity = ? AND city = ?
+"""
+
+
+# get_temperature(city) -> температура или None. Пользователи городов без погоды
+# сохраняют прежние нормы: подставлять DEFAULT_TEMPERATURE всем разом хуже, чем ничего не менять.
+async def recompute_goals(database: Database, get_temperature, chunk_size: int = 5000,
+                          concurrency: int = 8, pause: float = 0.01) -> GoalsReport:
+    import numpy as np
+
+    async with database.read() as db:
+        async with db.execute("SELECT DISTINCT city FROM users WHERE city IS NOT NULL") as cursor:
+            cities = [city for (city,) in await cursor.fetchall()]
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(city):
+        async with semaphore:
+            return await get_temperature(city)
+
+    temperatures = dict(zip(cities, await asyncio.gather(*(fetch(city) for city in cities))))
+    temperatures = {city: temp for city, temp in temperatures.items() if temp is not None}
+
+    checked = updated = 0
+    last_user_id = -1
+    while True:
+        async with database.read() as db:
+            async with db.execute(PROFILE_SQL, (last_user_id, chunk_size)) as cursor:
+                rows = await cursor.fetchall()
+        if not rows:
+            break
+        last_user_id = rows[-1][0]
+
+        rows = [row for row in rows if row[5] in temperatures]
+        if rows:
+            checked += len(rows)
+            columns = np.array([row[1:5] for row in rows], dtype=np.float64)
+            temp = np.array([temperatures[row[5]] for row in rows], dtype=np.float64)
+            calories, water = goals_for_arrays(*columns.T, temp)
+            old = np.array([[row[6] or 0, row[7] or 0] for row in rows], dtype=np.float64)
+            changed = np.flatnonzero((np.abs(calories - old[:, 0]) > 0.005) | (np.abs(water - old[:, 1]) > 0.005))
+            if len(changed):
+                async with database.write() as db:
+                    await db.executemany(UPDATE_SQL, [
+                        (calories[i].item(), water[i].item(), *rows[i][:6]) for i in changed.tolist()
+                    ])
+                updated += len(changed)
+        await asyncio.sleep(pause)
+
+    report = GoalsReport(len(cities), len(cities) - len(temperatures), checked, updated)
+    logging.info("Нормы пересчитаны: городов %d (без погоды %d), проверено профилей %d, обновлено %d", *report)
+    return report
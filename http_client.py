@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import random
+import time
+
+import aiohttp
+
+from metrics import HTTP_SECONDS
+
+# Общий HTTP-клиент бота: одна сессия с пулом соединений и DNS-кэшем на всё приложение.
+# Для каждого внешнего сервиса (Upstream) свои таймаут, число повторов и
+# предохранитель (circuit breaker): после серии отказов запросы к сервису какое-то
+# время не отправляются вовсе, и вызывающий код сразу уходит в свой запасной вариант.
+
+
+class UpstreamError(Exception):
+    def __init__(self, upstream: str, reason):
+        super().__init__(f"{upstream}: {reason}")
+        self.upstream = upstream
+        self.reason = reason
+
+
+class CircuitOpen(UpstreamError):
+    pass
+
+
+class Upstream:
+    def __init__(self, name: str, timeout: float = 5, retries: int = 2,
+                 failure_threshold: int = 5, reset_timeout: float = 30):
+        self.name = name
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.retries = retries
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False  # в полуоткрытом состоянии идёт пробный запрос
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    # в полуоткрытом состоянии пропускается один пробный запрос, остальные
+    # получают отказ, пока он не завершится
+    def allow_request(self):
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "open" or self.probing:
+            return False
+        self.probing = True
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.probing = False
+        if self.state == "half-open" or self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                logging.warning("%s: предохранитель разомкнут после %d ошибок", self.name, self.failures)
+            self.opened_at = time.monotonic()
+
+
+# статусы, при которых имеет смысл повторить запрос
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class HttpClient:
+    def __init__(self, limit: int = 100, limit_per_host: int = 20, dns_ttl: int = 300,
+                 backoff_base: float = 0.2, backoff_max: float = 2.0):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_ttl = dns_ttl
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._session = None
+
+    async def start(self):
+        if self._session is None:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit, limit_per_host=self.limit_per_host, ttl_dns_cache=self.dns_ttl
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _backoff(self, attempt: int):
+        # «full jitter»: случайная пауза до экспоненциально растущего предела
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def get_json(self, upstream: Upstream, url: str, params=None):
+        if not upstream.allow_request():
+            HTTP_SECONDS.observe(0, upstream.name, "circuit_open")
+            raise CircuitOpen(upstream.name, "предохранитель разомкнут")
+        probe = upstream.probing
+
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            await self.start()
+            data = await self._get_json(upstream, url, params)
+            outcome = "ok"
+            return data
+        finally:
+            HTTP_SECONDS.observe(time.perf_counter() - started, upstream.name, outcome)
+            if probe:
+                # проба отменена, не дойдя до ответа, — следующий запрос попробует снова
+                upstream.probing = False
+
+    async def _get_json(self, upstream: Upstream, url: str, params):
+        for attempt in range(upstream.retries + 1):
+            try:
+                async with self._session.get(url, params=params, timeout=upstream.timeout) as response:
+                    if response.status == 200:
+                        data = await response.json(content_type=None)
+                        upstream.record_success()
+                        return data
+                    if response.status not in RETRY_STATUSES:
+                        # ошибка на нашей стороне (404, 401 ...) — сервис жив, повторять бессмысленно
+                        upstream.record_success()
+                        raise UpstreamError(upstream.name, f"HTTP {response.status}")
+                    error = UpstreamError(upstream.name, f"HTTP {response.status}")
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                error = UpstreamError(upstream.name, repr(e))
+
+            upstream.record_failure()
+            if attempt == upstream.retries or not upstream.allow_request():
+                raise error
+            await asyncio.sleep(self._backoff(attempt))
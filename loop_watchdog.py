@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+from metrics import LOOP_LAG_SECONDS, metric_lines
+
+# Сторож event loop. Задача в самом loop раз в interval отмечает «пульс» и
+# измеряет задержку пробуждения (гистограмма bot_event_loop_lag_seconds).
+# Вспомогательный поток проверяет пульс; если loop молчит дольше threshold,
+# значит, какой-то код выполняется синхронно — поток снимает стек главного потока
+# и запоминает обработчик бота и строку, на которой он стоит (отчёт report и
+# bot_event_loop_blocked_seconds_total по местам). Пока loop свободен,
+# работы почти нет: одно пробуждение задачи за interval и потока за threshold / 2.
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+# middleware метрик оборачивают каждый обработчик — обработчиком считается то, что внутри них
+WRAPPERS = (os.path.join(APP_DIR, "metrics.py"), os.path.abspath(__file__))
+
+
+def _in_app(filename: str) -> bool:
+    return filename.startswith(APP_DIR) and filename not in WRAPPERS
+
+
+def _where(frame) -> str:
+    return f"{os.path.relpath(frame.filename, APP_DIR)}:{frame.lineno} {frame.name}"
+
+
+# (обработчик, место) по стеку: внешний и внутренний кадры кода бота
+# (у задачи asyncio стек начинается с её корутины, а не с main),
+# если код бота в стеке не найден — самый внутренний кадр
+def blocking_site(stack):
+    app_frames = [frame for frame in stack if _in_app(frame.filename)]
+    if not app_frames:
+        top = stack[-1]
+        return "unknown", f"{top.filename}:{top.lineno} {top.name}"
+    return app_frames[0].name, _where(app_frames[-1])
+
+
+class LoopWatchdog:
+    def __init__(self, threshold: float = 0.1, interval: float = 0.05, report_interval: float = 600, top: int = 10):
+        self.threshold = threshold
+        self.interval = interval
+        self.report_interval = report_interval
+        self.top = top
+        self._lock = threading.Lock()
+        self._blocked = {}  # (обработчик, место) -> [число блокировок, секунды]
+        self._episode = None  # стек текущей блокировки, пока loop не проснулся
+        self._heartbeat = time.monotonic()
+        self._stopping = threading.Event()
+        self._task = None
+        self._thread = None
+        self._main_thread = None
+
+    def start(self):
+        self._main_thread = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopping.clear()
+        self._task = asyncio.create_task(self._beat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def close(self):
+        self._stopping.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._thread is not None:
+            await asyncio.to_thread(self._thread.join)
+            self._thread = None
+        if self._blocked:
+            logging.info("Блокировки event loop за время работы:\n%s", self.format_report())
+
+    async def _beat(self):
+        last_report = time.monotonic()
+        while True:
+            started = time.monotonic()
+            self._heartbeat = started
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = now - started - self.interval
+            LOOP_LAG_SECONDS.observe(max(lag, 0.0))
+            self._heartbeat = now
+            episode, self._episode = self._episode, None
+            if episode is not None:
+                handler, where, stack = episode
+                logging.warning("Event loop заблокирован на %.3f с в %s (%s):\n%s",
+                                lag, handler, where, "".join(traceback.format_list(stack[-12:])))
+            if now - last_report >= self.report_interval and self._blocked:
+                logging.info("Блокировки event loop:\n%s", self.format_report())
+                last_report = now
+
+    def _watch(self):
+        check = self.threshold / 2
+        sampled_beat = None
+        while not self._stopping.wait(check):
+            beat = self._heartbeat
+            silent = time.monotonic() - beat - self.interval
+            if silent < self.threshold:
+                continue
+            frame = sys._current_frames().get(self._main_thread)
+            if frame is None:
+                continue
+            stack = traceback.extract_stack(frame)
+            del frame
+            handler, where = blocking_site(stack)
+            with self._lock:
+                entry = self._blocked.setdefault((handler, where), [0, 0.0])
+                if beat != sampled_beat:
+                    # первая выборка этой блокировки: до неё loop уже молчал silent секунд
+                    entry[0] += 1
+                    entry[1] += silent
+                    sampled_beat = beat
+                    self._episode = (handler, where, stack)
+                else:
+                    entry[1] += check
+
+    # [(обработчик, место, блокировок, секунд)], самые долгие первыми
+    def report(self, top: int = None):
+        with self._lock:
+            rows = [(handler, where, count, seconds) for (handler, where), (count, seconds) in self._blocked.items()]
+        rows.sort(key=lambda row: row[3], reverse=True)
+        return rows[:top or self.top]
+
+    # для REGISTRY.add_collector: все места, где loop хоть раз блокировался, — серия
+    # счётчика не должна пропадать при выпадении из top. Мест столько, сколько
+    # строк кода с блокировками, так что число серий ограничено
+    def collect(self):
+        with self._lock:
+            rows = [(handler, where, count, seconds) for (handler, where), (count, seconds) in self._blocked.items()]
+        yield from metric_lines("bot_event_loop_blocked_seconds_total", "counter",
+                                "Время, на которое код блокировал event loop, по местам", [
+            ("", [("handler", handler), ("frame", where)], seconds) for handler, where, _, seconds in rows
+        ])
+        yield from metric_lines("bot_event_loop_blocks_total", "counter", "Число блокировок event loop по местам", [
+            ("", [("handler", handler), ("frame", where)], count) for handler, where, count, _ in rows
+        ])
+
+    def format_report(self, top: int = None) -> str:
+        return "\n".join(
+            f"{seconds:8.3f} с  {count:5d} раз  {handler}  {where}"
+            for handler, where, count, seconds in self.report(top)
+        )
@@ -0,0 +1,91 @@
+import asyncio
+import re
+from typing import NamedTuple
+
+# Приём пищи одной строкой: «200 г гречка, 1 яблоко, курица 150 г».
+# Позиции разделяются запятой (кроме десятичной), точкой с запятой, «+» или переносом строки;
+# количество — до или после названия. Единицы: г, кг, мл, л, шт. Число без единицы
+# до MAX_PIECES считается штуками, больше — граммами. Вес штуки берётся из
+# PIECE_GRAMS по началу названия, иначе DEFAULT_PIECE_GRAMS.
+
+MAX_ITEMS = 20
+MAX_PIECES = 20
+DEFAULT_PIECE_GRAMS = 100
+PIECE_GRAMS = {
+    "яблок": 180, "груш": 170, "банан": 120, "апельсин": 200, "мандарин": 80, "персик": 150,
+    "яйц": 55, "огур": 120, "помидор": 120, "томат": 120, "картоф": 150,
+    "хлеб": 30, "батон": 30, "булк": 60, "печень": 15, "конфет": 15, "сырник": 60, "блин": 50,
+    "котлет": 90, "сосиск": 50, "йогурт": 125, "кефир": 250, "молок": 250, "кофе": 200, "чай": 200,
+}
+UNITS = {"г": 1, "гр": 1, "грамм": 1, "граммов": 1, "грамма": 1, "мл": 1, "кг": 1000, "л": 1000,
+         "шт": None, "штук": None, "штуки": None, "штука": None}
+
+_NUMBER = r"(\d+(?:[.,]\d+)?)"
+_UNIT = r"(" + "|".join(sorted(map(re.escape, UNITS), key=len, reverse=True)) + r")?\.?"
+_LEADING = re.compile(rf"^{_NUMBER}\s*{_UNIT}\s+(.+)$")
+_TRAILING = re.compile(rf"^(.+?)\s+{_NUMBER}\s*{_UNIT}$")
+# запятая между цифрами — десятичная: «1,5 кг»
+_SEPARATORS = re.compile(r"(?:(?<!\d),|,(?!\d)|[;+\n])+")
+
+
+class MealItem(NamedTuple):
+    text: str  # позиция как её написал пользователь
+    name: str
+    grams: float  # None, если количество не указано
+    pieces: float  # None, если указан вес
+    unit: str  # единица как написана, None, если было только число
+
+
+def _grams(number: str, unit: str, name: str):
+    quantity = float(number.replace(",", "."))
+    unit = (unit or "").lower()
+    if unit and UNITS[unit] is not None:
+        return quantity * UNITS[unit], None
+    if not unit and quantity > MAX_PIECES:
+        return quantity, None
+    lowered = name.lower()
+    piece = next((grams for stem, grams in PIECE_GRAMS.items() if lowered.startswith(stem)), DEFAULT_PIECE_GRAMS)
+    return quantity * piece, quantity
+
+
+def parse_meal(text: str):
+    items = []
+    for part in _SEPARATORS.split(text or ""):
+        part = " ".join(part.split())
+        if not part:
+            continue
+        match = _LEADING.match(part)
+        if match:
+            number, unit, name = match.groups()
+        else:
+            match = _TRAILING.match(part)
+            if match:
+                name, number, unit = match.groups()
+            else:
+                items.append(MealItem(part, part, None, None, None))
+                continue
+        grams, pieces = _grams(number, unit, name)
+        items.append(MealItem(part, name, grams, pieces, unit))
+    return items[:MAX_ITEMS]
+
+
+# похоже ли сообщение на приём пищи, а не на одно название продукта: хотя бы у одной
+# позиции есть количество. «Сыр, плавленый» или «хлеб + масло» — это название.
+# Без bare_numbers количество считается, только если указана единица:
+# в ответ на вопрос о названии «Молоко 3,2» или «яйцо 2» — это название, а не количество
+def is_meal(items, bare_numbers: bool = True) -> bool:
+    return any(item.grams is not None and (bare_numbers or item.unit) for item in items)
+
+
+# Калорийность всех позиций: одинаковые названия ищутся один раз, не больше
+# concurrency поисков одновременно. Возвращает [(позиция, {"name", "calories"} или None)]
+async def resolve_meal(items, lookup, concurrency: int = 4):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def resolve(name):
+        async with semaphore:
+            return await lookup(name)
+
+    names = list(dict.fromkeys(item.name.lower() for item in items if item.grams is not None))
+    found = dict(zip(names, await asyncio.gather(*(resolve(name) for name in names))))
+    return [(item, found.get(item.name.lower()) if item.grams is not None else None) for item in items]
@@ -0,0 +1,216 @@
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+# Метрики бота в текстовом формате Prometheus (отдаются на /metrics).
+# Своя маленькая реализация: гистограммы и счётчики с метками, без внешних
+# зависимостей, чтобы её можно было импортировать из любого модуля (db, http_client, charts).
+# Состояние других компонентов (кэши графиков и профилей) снимается
+# в момент запроса через collectors — функции, возвращающие готовые строки.
+
+# границы корзин гистограмм времени, секунды
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def metric_lines(name: str, kind: str, documentation: str, samples):
+    # samples: [(суффикс, [(метка, значение), ...], значение), ...]
+    yield f"# HELP {name} {documentation}"
+    yield f"# TYPE {name} {kind}"
+    for suffix, labels, value in samples:
+        yield f"{name}{suffix}{format_labels(labels)} {format_value(value)}"
+
+
+def histogram_samples(labels, buckets, cumulative_counts, count, total):
+    for bound, value in zip(buckets, cumulative_counts):
+        yield "_bucket", labels + [("le", format_value(float(bound)))], value
+    yield "_bucket", labels + [("le", "+Inf")], count
+    yield "_sum", labels, total
+    yield "_count", labels, count
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # метки -> [счётчики по корзинам (не накопленные)..., выше последней границы, сумма]
+        self._series = {}
+
+    def observe(self, value: float, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def collect(self):
+        samples = []
+        for labels, series in sorted(self._series.items()):
+            cumulative, running = [], 0
+            for count in series[:len(self.buckets)]:
+                running += count
+                cumulative.append(running)
+            count = running + series[len(self.buckets)]
+            samples.extend(histogram_samples(
+                list(zip(self.labelnames, labels)), self.buckets, cumulative, count, series[-1]
+            ))
+        return metric_lines(self.name, "histogram", self.documentation, samples)
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def collect(self):
+        samples = [
+            ("", list(zip(self.labelnames, labels)), value)
+            for labels, value in sorted(self._values.items())
+        ]
+        return metric_lines(self.name, "counter", self.documentation, samples)
+
+
+class Gauge:
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def collect(self):
+        samples = [
+            ("", list(zip(self.labelnames, labels)), value)
+            for labels, value in sorted(self._values.items())
+        ]
+        return metric_lines(self.name, "gauge", self.documentation, samples)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        for collector in self._collectors:
+            lines.extend(collector())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+UPDATE_SECONDS = REGISTRY.register(Histogram(
+    "bot_update_seconds", "Полное время обработки обновления, включая FSM и фильтры", ("event_type",)
+))
+HANDLER_SECONDS = REGISTRY.register(Histogram(
+    "bot_handler_seconds", "Время работы обработчика", ("handler", "command", "state")
+))
+HANDLER_ERRORS = REGISTRY.register(Counter(
+    "bot_handler_errors_total", "Исключения в обработчиках", ("handler",)
+))
+FUNCTION_SECONDS = REGISTRY.register(Histogram(
+    "bot_function_seconds", "Время работы отдельных шагов обработчиков", ("function",)
+))
+DB_SECONDS = REGISTRY.register(Histogram(
+    "bot_db_seconds", "Ожидание соединения (wait) и работа с ним (query) в пуле SQLite", ("mode", "phase")
+))
+HTTP_SECONDS = REGISTRY.register(Histogram(
+    "bot_http_request_seconds", "Запросы к внешним сервисам вместе с повторами", ("upstream", "outcome")
+))
+CHART_RENDER_SECONDS = REGISTRY.register(Histogram(
+    "bot_chart_render_seconds", "Построение графиков в пуле процессов, включая ожидание воркера", ("chart",)
+))
+DELIVERY_SECONDS = REGISTRY.register(Histogram(
+    "bot_delivery_seconds", "Время от вызова отправки до ответа Telegram", ("lane",),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+))
+DELIVERY_QUEUED = REGISTRY.register(Gauge(
+    "bot_delivery_queued", "Сообщения, ждущие лимитов Telegram", ("lane",)
+))
+DELIVERY_RETRY_AFTER = REGISTRY.register(Counter(
+    "bot_delivery_retry_after_total", "Ответы Telegram 429 (RetryAfter)"
+))
+LOOP_LAG_SECONDS = REGISTRY.register(Histogram(
+    "bot_event_loop_lag_seconds", "Опоздание пробуждения задачи-сторожа относительно расписания"
+))
+
+
+# Для шагов внутри обработчиков: @timed над async-функцией
+def timed(func):
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        with FUNCTION_SECONDS.time(func.__name__):
+            return await func(*args, **kwargs)
+    return wrapper
+
+
+# Внешний middleware на dp.update: всё время обновления, включая чтение состояния FSM
+class UpdateMetrics:
+    async def __call__(self, handler, event, data):
+        with UPDATE_SECONDS.time(event.event_type):
+            return await handler(event, data)
+
+
+# Внутренний middleware на dp.message / dp.callback_query: вызывается уже после
+# фильтров, поэтому известны обработчик, сработавшая команда и состояние FSM
+class HandlerMetrics:
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        name = getattr(handler_object.callback, "__name__", "unknown") if handler_object else "unknown"
+        command = data.get("command")
+        labels = (name, f"/{command.command}" if command else "", data.get("raw_state") or "")
+
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, *labels)
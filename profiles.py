@@ -0,0 +1,211 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+
+from db import Database
+
+# Кэш профилей (строк users) в памяти процесса: нормы воды и калорий нужны почти
+# каждому обработчику, и читать их из базы на каждое сообщение незачем.
+# - запись профиля — компактный Profile со __slots__ (~450 байт вместе со значениями,
+#   сроком жизни и записью LRU, см. benchmarks/profile_cache_bench.py);
+# - LRU на max_entries профилей, отсутствие профиля тоже кэшируется;
+# - у записи есть срок жизни: ttl для профиля и короткий negative_ttl для «профиля нет»,
+#   так что без рассылки сбросов (несколько процессов на общей базе) чужие изменения
+#   видны не позже чем через ttl;
+# - заполняется при первом обращении или заранее (warm) для недавно активных;
+# - write-through: кто меняет users, сразу кладёт новый профиль (put) или сбрасывает
+#   запись (invalidate); on_change получает user_id (None — все), чтобы другие
+#   процессы бота сбросили свои копии (см. RedisInvalidation).
+
+PROFILE_FIELDS = ("weight", "height", "age", "activity", "city", "calorie_goal", "water_goal")
+SELECT_SQL = f"SELECT {', '.join(PROFILE_FIELDS)} FROM users WHERE user_id = ?"
+
+
+class Profile:
+    __slots__ = PROFILE_FIELDS
+
+    def __init__(self, weight, height, age, activity, city, calorie_goal, water_goal):
+        self.weight = weight
+        self.height = height
+        self.age = age
+        self.activity = activity
+        self.city = city
+        self.calorie_goal = calorie_goal
+        self.water_goal = water_goal
+
+    def __repr__(self):
+        return "Profile(" + ", ".join(f"{field}={getattr(self, field)!r}" for field in PROFILE_FIELDS) + ")"
+
+
+class ProfileCache:
+    def __init__(self, database: Database, max_entries: int = 100000, on_change=None,
+                 ttl: float = 300, negative_ttl: float = 30):
+        self.database = database
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.on_change = on_change
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # user_id -> (expires_at, Profile или None — профиля нет)
+        # растёт при каждом изменении; загрузка, начатая до изменения, не кладёт в кэш старые данные
+        self._generation = 0
+
+    async def get(self, user_id: int):
+        entry = self._entries.get(user_id)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        generation = self._generation
+        async with self.database.read() as db:
+            async with db.execute(SELECT_SQL, (user_id,)) as cursor:
+                row = await cursor.fetchone()
+        profile = Profile(*row) if row else None
+        if generation == self._generation:
+            self._store(user_id, profile)
+        return profile
+
+    # После коммита записи в users: новый профиль сразу виден этому процессу
+    def put(self, user_id: int, profile: Profile):
+        # колонки users — INTEGER: SQLite вернёт 2604.0 как 2604, кэш должен отдавать то же, что база
+        for field in PROFILE_FIELDS:
+            value = getattr(profile, field)
+            if isinstance(value, float) and value.is_integer():
+                setattr(profile, field, int(value))
+        self._generation += 1
+        self._store(user_id, profile)
+        self._changed(user_id)
+
+    # user_id=None — сбросить всё (например, после массового пересчёта норм);
+    # notify=False — сброс пришёл от другого процесса, дальше не рассылаем
+    def invalidate(self, user_id: int = None, notify: bool = True):
+        self._generation += 1
+        if user_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(user_id, None)
+        if notify:
+            self._changed(user_id)
+
+    # Загрузка профилей заранее, пачками по user_id; since_day — только активные с этого дня
+    async def warm(self, since_day: int = None, batch_size: int = 5000):
+        sql = f"SELECT user_id, {', '.join(PROFILE_FIELDS)} FROM users WHERE user_id > ?"
+        if since_day is not None:
+            sql += " AND EXISTS (SELECT 1 FROM daily_totals t WHERE t.user_id = users.user_id AND t.day >= ?)"
+        sql += " ORDER BY user_id LIMIT ?"
+
+        loaded = 0
+        last_user_id = -1
+        while loaded < self.max_entries:
+            generation = self._generation
+            params = (last_user_id, since_day, batch_size) if since_day is not None else (last_user_id, batch_size)
+            async with self.database.read() as db:
+                async with db.execute(sql, params) as cursor:
+                    rows = await cursor.fetchall()
+            if generation == self._generation:
+                for user_id, *fields in rows:
+                    # то, что уже загружено по запросу, свежее и стоит ближе к концу LRU
+                    if user_id not in self._entries and len(self._entries) < self.max_entries:
+                        self._entries[user_id] = (time.monotonic() + self.ttl, Profile(*fields))
+                        self._entries.move_to_end(user_id, last=False)
+            loaded += len(rows)
+            if len(rows) < batch_size:
+                break
+            last_user_id = rows[-1][0]
+            await asyncio.sleep(0)
+        logging.info("Кэш профилей прогрет: %d профилей", len(self._entries))
+        return len(self._entries)
+
+    def stats(self):
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    def _store(self, user_id: int, profile):
+        ttl = self.ttl if profile is not None else self.negative_ttl
+        self._entries[user_id] = (time.monotonic() + ttl, profile)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _changed(self, user_id):
+        if self.on_change is not None:
+            try:
+                self.on_change(user_id)
+            except Exception:
+                logging.exception("Ошибка рассылки сброса кэша профилей")
+
+
+PROFILE_CACHE_SYNCS = ("none", "redis")
+
+
+# Сброс кэша профилей между процессами бота через Redis pub/sub:
+# сообщение «<процесс>:<user_id или *>», свои сообщения пропускаются
+class RedisInvalidation:
+    def __init__(self, cache: ProfileCache, redis_url: str, channel: str = "bot:profile_invalidate"):
+        self.cache = cache
+        self.redis_url = redis_url
+        self.channel = channel
+        self.origin = f"{os.getpid()}-{id(self)}"
+        self._redis = None
+        self._task = None
+        self._pending = set()
+        # redis нужен только для нескольких процессов, поэтому импортируем здесь —
+        # при создании, чтобы неверная настройка была видна сразу при запуске, а не в main()
+        try:
+            from redis.asyncio import Redis
+        except ImportError as e:
+            raise RuntimeError(
+                "PROFILE_CACHE_SYNC=redis требует пакет redis (pip install -r requirements.txt) "
+                "или PROFILE_CACHE_SYNC=none"
+            ) from e
+        self._redis_class = Redis
+
+    async def start(self):
+        self._redis = self._redis_class.from_url(self.redis_url)
+        pubsub = self._redis.pubsub()
+        await pubsub.subscribe(self.channel)
+        self._task = asyncio.create_task(self._listen(pubsub))
+        self.cache.on_change = self.publish
+
+    def publish(self, user_id):
+        message = f"{self.origin}:{'*' if user_id is None else user_id}"
+        task = asyncio.get_running_loop().create_task(self._publish(message))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _publish(self, message: str):
+        try:
+            await self._redis.publish(self.channel, message)
+        except Exception as e:
+            logging.warning("Не удалось разослать сброс кэша профилей: %s", e)
+
+    async def _listen(self, pubsub):
+        try:
+            async for message in pubsub.listen():
+                if message.get("type") != "message":
+                    continue
+                origin, _, target = message["data"].decode().rpartition(":")
+                if origin == self.origin:
+                    continue
+                self.cache.invalidate(None if target == "*" else int(target), notify=False)
+        finally:
+            await pubsub.aclose()
+
+    async def close(self):
+        self.cache.on_change = None
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
@@ -0,0 +1,137 @@
+import argparse
+import asyncio
+import logging
+from datetime import date, timedelta
+from typing import NamedTuple
+
+from db import Database, check_daily_totals, compacted_before, day_key, migrate, recompute_daily_total
+
+# Срок хранения сырых логов. Строки water_logs / food_logs / workout_logs старше
+# keep_days удаляются; итоги за эти дни остаются в daily_totals (их и читает
+# show_progress), а граница хранится в log_retention.compacted_before.
+# Всё делается короткими транзакциями с паузами, чтобы бот продолжал отвечать,
+# а освободившиеся страницы возвращаются ОС через PRAGMA incremental_vacuum.
+
+LOG_TABLES = ("water_logs", "food_logs", "workout_logs")
+
+
+class RetentionReport(NamedTuple):
+    compacted_before: int
+    rows_deleted: dict
+    totals_fixed: int
+    bytes_freed: int
+    # освобождено внутри файла, но не отдано ОС (auto_vacuum выключен)
+    freelist_bytes: int
+
+
+async def _page_stats(db):
+    stats = {}
+    for pragma in ("page_size", "page_count", "freelist_count", "auto_vacuum"):
+        async with db.execute(f"PRAGMA {pragma}") as cursor:
+            (stats[pragma],) = await cursor.fetchone()
+    return stats
+
+
+async def compact_logs(database: Database, keep_days: int, today: date, batch_size: int = 2000,
+                       vacuum_pages: int = 512, pause: float = 0.02) -> RetentionReport:
+    cutoff = day_key(today - timedelta(days=keep_days))
+
+    async with database.read() as db:
+        before = await _page_stats(db)
+        start = await compacted_before(db)
+        # итоги за удаляемые дни сверяем с логами, пока логи ещё есть (на читателе, без блокировки записи)
+        drift = await check_daily_totals(db, start, cutoff) if start < cutoff else []
+
+    for i in range(0, len(drift), batch_size):
+        async with database.write() as db:
+            for user_id, day in drift[i:i + batch_size]:
+                await recompute_daily_total(db, user_id, day)
+    if drift:
+        logging.warning("Перед компактификацией исправлено расхождений в daily_totals: %d", len(drift))
+
+    async with database.write() as db:
+        await db.execute("UPDATE log_retention SET compacted_before = MAX(compacted_before, ?)", (cutoff,))
+
+    # логи пишутся по порядку, поэтому старые строки — в начале таблицы, и каждая пачка находится быстро
+    rows_deleted = {}
+    for table in LOG_TABLES:
+        rows_deleted[table] = 0
+        while True:
+            async with database.write() as db:
+                cursor = await db.execute(
+                    f"DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table} WHERE day < ? LIMIT ?)",
+                    (cutoff, batch_size),
+                )
+                deleted = cursor.rowcount
+            rows_deleted[table] += deleted
+            if deleted < batch_size:
+                break
+            await asyncio.sleep(pause)
+
+    if before["auto_vacuum"] == 2:
+        while True:
+            async with database.write() as db:
+                async with db.execute("PRAGMA freelist_count") as cursor:
+                    (free,) = await cursor.fetchone()
+                if not free:
+                    break
+                async with db.execute(f"PRAGMA incremental_vacuum({vacuum_pages})") as cursor:
+                    await cursor.fetchall()
+            await asyncio.sleep(pause)
+
+    async with database.read() as db:
+        after = await _page_stats(db)
+
+    report = RetentionReport(
+        compacted_before=cutoff,
+        rows_deleted=rows_deleted,
+        totals_fixed=len(drift),
+        bytes_freed=max(0, before["page_count"] - after["page_count"]) * after["page_size"],
+        freelist_bytes=after["freelist_count"] * after["page_size"],
+    )
+    logging.info(
+        "Компактификация логов до %s: удалено строк %s, освобождено %d байт, в freelist %d байт",
+        cutoff, rows_deleted, report.bytes_freed, report.freelist_bytes,
+    )
+    if before["auto_vacuum"] != 2 and report.freelist_bytes:
+        logging.warning("auto_vacuum не INCREMENTAL: место остаётся в файле; один раз выполните "
+                        "python retention.py --enable-incremental-vacuum")
+    return report
+
+
+# Перевод существующей базы в auto_vacuum=INCREMENTAL: полный VACUUM, бот лучше остановить
+async def enable_incremental_vacuum(database: Database):
+    async with database.write() as db:
+        await db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        await db.execute("VACUUM")
+
+
+# Обслуживание: python retention.py --keep-days 365
+async def _cli(args):
+    database = Database(args.db, readers=1)
+    await database.open()
+    try:
+        async with database.write() as db:
+            await migrate(db)
+        if args.enable_incremental_vacuum:
+            await enable_incremental_vacuum(database)
+            print("auto_vacuum = INCREMENTAL, база перестроена")
+        report = await compact_logs(database, args.keep_days, date.today(), batch_size=args.batch_size)
+        for table, rows in report.rows_deleted.items():
+            print(f"{table}: удалено строк {rows}")
+        print(f"Сырые логи хранятся с {report.compacted_before}")
+        print(f"Исправлено итогов перед удалением: {report.totals_fixed}")
+        print(f"Освобождено: {report.bytes_freed / 1024 / 1024:.1f} МБ, осталось в freelist: {report.freelist_bytes / 1024 / 1024:.1f} МБ")
+    finally:
+        await database.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Срок хранения сырых логов")
+    parser.add_argument("--db", default="bot_database.db")
+    parser.add_argument("--keep-days", type=int, default=365)
+    parser.add_argument("--batch-size", type=int, default=2000)
+    parser.add_argument("--enable-incremental-vacuum", action="store_true",
+                        help="один раз перевести существующую базу в auto_vacuum=INCREMENTAL (полный VACUUM)")
+    asyncio.run(_cli(parser.parse_args()))
@@ -0,0 +1,207 @@
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+
+from aiogram.exceptions import TelegramAPIError, TelegramForbiddenError
+
+from db import Database, day_key
+from delivery import bulk_delivery
+
+# Плановые рассылки: напоминания о воде днём и сводка за день вечером.
+# Кому писать, выбирается одним запросом на пачку пользователей (keyset по user_id),
+# пачки обрабатываются по очереди, чтобы не держать event loop и базу на 100k пользователях.
+# Отправка идёт через delivery в «массовой» полосе, так что ответы пользователям не ждут рассылку.
+
+CHUNK_SIZE = 500
+
+# отстающие по воде: выпито меньше доли water_fraction от нормы
+BEHIND_ON_WATER_SQL = """
+    SELECT u.user_id, u.water_goal, COALESCE(t.water_ml, 0)
+    FROM users u
+    LEFT JOIN daily_totals t ON t.user_id = u.user_id AND t.day = ?
+    WHERE u.user_id > ? AND u.water_goal IS NOT NULL AND COALESCE(t.water_ml, 0) < u.water_goal * ?
+    ORDER BY u.user_id
+    LIMIT ?
+"""
+
+DIGEST_SQL = """
+    SELECT u.user_id, u.water_goal, u.calorie_goal,
+           COALESCE(t.water_ml, 0), COALESCE(t.kcal_in, 0), COALESCE(t.kcal_burned, 0)
+    FROM users u
+    LEFT JOIN daily_totals t ON t.user_id = u.user_id AND t.day = ?
+    WHERE u.user_id > ?
+    ORDER BY u.user_id
+    LIMIT ?
+"""
+
+
+def format_water_reminder(row):
+    _, water_goal, water_total = row
+    return (
+        f"💧 Напоминание: сегодня выпито {water_total} мл из {water_goal} мл.\n"
+        f"Осталось {max(0, water_goal - water_total)} мл — запиши воду через /log_water"
+    )
+
+
+def format_digest(row):
+    _, water_goal, calorie_goal, water_total, food_total, burned_total = row
+    if not (water_total or food_total or burned_total):
+        return "🌙 Сегодня ты ничего не записал. Завтра новый день — /log_water, /log_food, /log_workout!"
+    # нормы может не быть (профиль не заполнен или загружен через /import без них)
+    water_line = f"{water_total} мл" + (f" / {water_goal} мл {'✅' if water_total >= water_goal else ''}" if water_goal is not None else "")
+    food_line = f"{food_total:.0f} ккал" + (f" / {calorie_goal} ккал {'✅' if food_total <= calorie_goal else '⚠️'}" if calorie_goal is not None else "")
+    return f"""🌙 Итоги дня:
+💧 Вода: {water_line}
+🍏 Калории: {food_line}
+🔥 Сожжено: {burned_total} ккал
+⚖ Баланс: {food_total - burned_total:.0f} ккал"""
+
+
+class DailyJob(ABC):
+    def __init__(self, name: str, at: str):
+        hour, minute = map(int, at.split(":"))
+        self.name = name
+        self.hour = hour
+        self.minute = minute
+
+    def next_run(self, now: datetime) -> datetime:
+        run = now.replace(hour=self.hour, minute=self.minute, second=0, microsecond=0)
+        return run if run > now else run + timedelta(days=1)
+
+    @abstractmethod
+    async def run(self, scheduler, day: int):
+        pass
+
+
+# Рассылка: получатели выбираются запросом sql, текст — formatter(строка)
+class BroadcastJob(DailyJob):
+    def __init__(self, name: str, at: str, sql: str, formatter, params=()):
+        super().__init__(name, at)
+        self.sql = sql
+        self.formatter = formatter
+        self.params = params
+
+    async def run(self, scheduler, day: int):
+        sent = 0
+        last_user_id = 0
+        while True:
+            async with scheduler.database.read() as db:
+                async with db.execute(self.sql, (day, last_user_id, *self.params, CHUNK_SIZE)) as cursor:
+                    rows = await cursor.fetchall()
+            if not rows:
+                break
+            last_user_id = rows[-1][0]
+
+            with bulk_delivery():
+                results = await asyncio.gather(*(self._send(scheduler, row) for row in rows), return_exceptions=True)
+            sent += sum(result is True for result in results)
+
+        logging.info("Задача %s: отправлено %d сообщений", self.name, sent)
+        return sent
+
+    # ошибка на одном пользователе не должна обрывать рассылку остальным
+    async def _send(self, scheduler, row) -> bool:
+        try:
+            return await scheduler.send(row[0], self.formatter(row))
+        except Exception:
+            logging.exception("Задача %s: ошибка для пользователя %s", self.name, row[0])
+            return False
+
+
+# Обслуживание без рассылки (например, компактификация логов)
+class TaskJob(DailyJob):
+    def __init__(self, name: str, at: str, func):
+        super().__init__(name, at)
+        self.func = func
+
+    async def run(self, scheduler, day: int):
+        return await self.func()
+
+
+class Scheduler:
+    def __init__(self, bot, database: Database, tz, jobs):
+        self.bot = bot
+        self.database = database
+        self.tz = tz
+        self.jobs = jobs
+        self._task = None
+        self._running = set()
+
+    def start(self):
+        if self._task is None and self.jobs:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in list(self._running):
+            task.cancel()
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+
+    # Время следующего запуска считается от предыдущего, а не от «сейчас», и каждая
+    # задача идёт отдельным task: долгая рассылка не сдвигает и не съедает
+    # запуски других задач, у которых время подошло, пока она работала
+    async def _run(self):
+        now = datetime.now(self.tz)
+        next_runs = {job: job.next_run(now) for job in self.jobs}
+        while True:
+            run_at = min(next_runs.values())
+            now = datetime.now(self.tz)
+            if run_at > now:
+                await asyncio.sleep((run_at - now).total_seconds())
+                continue
+            for job, job_run_at in next_runs.items():
+                if job_run_at <= now:
+                    task = asyncio.create_task(self._run_logged(job, day_key(job_run_at)))
+                    self._running.add(task)
+                    task.add_done_callback(self._running.discard)
+                    next_runs[job] = job.next_run(job_run_at)
+
+    async def _run_logged(self, job: DailyJob, day: int):
+        try:
+            await self.run_job(job, day)
+        except Exception:
+            logging.exception("Плановая задача %s завершилась с ошибкой", job.name)
+
+    # Запуск «забирается» в базе: второй процесс или повтор после рестарта его пропустят
+    async def _claim(self, job: DailyJob, day: int) -> bool:
+        async with self.database.write() as db:
+            cursor = await db.execute("""
+                INSERT INTO scheduler_runs (job, last_day) VALUES (?, ?)
+                ON CONFLICT (job) DO UPDATE SET last_day = excluded.last_day WHERE last_day < excluded.last_day
+            """, (job.name, day))
+            return cursor.rowcount == 1
+
+    async def run_job(self, job: DailyJob, day: int):
+        if not await self._claim(job, day):
+            logging.info("Задача %s за %s уже выполнена", job.name, day)
+            return None
+        return await job.run(self, day)
+
+    async def send(self, user_id: int, text: str) -> bool:
+        try:
+            await self.bot.send_message(user_id, text)
+            return True
+        except TelegramForbiddenError:
+            # пользователь заблокировал бота
+            return False
+        except TelegramAPIError as e:
+            logging.warning("Не удалось отправить сообщение %s: %s", user_id, e)
+            return False
+
+
+def default_jobs(reminder_times, digest_time: str, water_fraction: float = 0.5):
+    jobs = [
+        BroadcastJob(f"water_reminder_{at}", at, BEHIND_ON_WATER_SQL, format_water_reminder, params=(water_fraction,))
+        for at in reminder_times
+    ]
+    if digest_time:
+        jobs.append(BroadcastJob("evening_digest", digest_time, DIGEST_SQL, format_digest))
+    return jobs
@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+from datetime import date, timedelta
+from typing import TYPE_CHECKING, NamedTuple
+
+from db import day_key
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# Тренды за несколько дней: данные берутся одним запросом из daily_totals,
+# а всё остальное (скользящие средние, серии, дефицит/профицит) считается в NumPy.
+# NumPy импортируется при первом расчёте, а не при старте бота.
+
+TREND_RANGES = (7, 30, 90)
+
+
+class TrendReport(NamedTuple):
+    days: int
+    dates: list
+    water: np.ndarray
+    kcal_in: np.ndarray
+    kcal_burned: np.ndarray
+    water_goal: float
+    calorie_goal: float
+    window: int
+    water_avg: np.ndarray
+    kcal_avg: np.ndarray
+    logged_days: int
+    water_hit_days: int
+    water_best_streak: int
+    water_current_streak: int
+    calorie_hit_days: int
+    deficit_total: float
+    surplus_total: float
+
+
+async def load_daily_totals(db, user_id: int, start: date, end: date):
+    async with db.execute(
+        "SELECT day, water_ml, kcal_in, kcal_burned FROM daily_totals WHERE user_id = ? AND day BETWEEN ? AND ? ORDER BY day",
+        (user_id, day_key(start), day_key(end)),
+    ) as cursor:
+        return await cursor.fetchall()
+
+
+def rolling_mean(values: np.ndarray, window: int) -> np.ndarray:
+    import numpy as np
+
+    # для первых дней окно неполное — делим на фактическое число точек
+    sums = np.cumsum(values, dtype=float)
+    sums[window:] = sums[window:] - sums[:-window]
+    counts = np.minimum(np.arange(1, len(values) + 1), window)
+    return sums / counts
+
+
+def streaks(hits: np.ndarray):
+    import numpy as np
+
+    # длины всех серий подряд идущих True через границы серий в diff
+    padded = np.concatenate(([0], hits.astype(np.int8), [0]))
+    edges = np.flatnonzero(np.diff(padded))
+    lengths = edges[1::2] - edges[::2]
+    best = int(lengths.max()) if lengths.size else 0
+    current = int(lengths[-1]) if lengths.size and hits[-1] else 0
+    return best, current
+
+
+def build_trend_report(rows, end: date, days: int, water_goal, calorie_goal) -> TrendReport:
+    import numpy as np
+
+    start = end - timedelta(days=days - 1)
+    dates = [start + timedelta(days=i) for i in range(days)]
+
+    water = np.zeros(days)
+    kcal_in = np.zeros(days)
+    kcal_burned = np.zeros(days)
+    if rows:
+        table = np.array(rows, dtype=float)
+        keys = table[:, 0].astype(np.int64)
+        ordinals = np.array([date(k // 10000, k // 100 % 100, k % 100).toordinal() for k in keys])
+        offsets = ordinals - start.toordinal()
+        water[offsets] = table[:, 1]
+        kcal_in[offsets] = table[:, 2]
+        kcal_burned[offsets] = table[:, 3]
+
+    window = 3 if days <= 7 else 7
+    logged = (water > 0) | (kcal_in > 0) | (kcal_burned > 0)
+    water_hits = water >= water_goal
+    best, current = streaks(water_hits)
+
+    # баланс считаем только по дням, когда еда вообще записывалась
+    net = (kcal_in - kcal_burned - calorie_goal)[kcal_in > 0]
+
+    return TrendReport(
+        days=days,
+        dates=dates,
+        water=water,
+        kcal_in=kcal_in,
+        kcal_burned=kcal_burned,
+        water_goal=water_goal,
+        calorie_goal=calorie_goal,
+        window=window,
+        water_avg=rolling_mean(water, window),
+        kcal_avg=rolling_mean(kcal_in - kcal_burned, window),
+        logged_days=int(logged.sum()),
+        water_hit_days=int(water_hits.sum()),
+        water_best_streak=best,
+        water_current_streak=current,
+        calorie_hit_days=int(((kcal_in > 0) & (kcal_in - kcal_burned <= calorie_goal)).sum()),
+        deficit_total=float(-net[net < 0].sum()),
+        surplus_total=float(net[net > 0].sum()),
+    )
+
+
+def format_trend_report(report: TrendReport) -> str:
+    logged = max(report.logged_days, 1)
+    return f"""📈 Тренды за {report.days} дн. ({report.dates[0]:%d-%m-%Y} — {report.dates[-1]:%d-%m-%Y}):
+📝 Дней с записями: {report.logged_days} из {report.days}
+💧 Вода в среднем: {report.water.sum() / logged:.0f} мл / {report.water_goal} мл
+✅ Норма воды выполнена: {report.water_hit_days} дн. (лучшая серия: {report.water_best_streak}, текущая: {report.water_current_streak})
+🍏 Калории в среднем: {report.kcal_in.sum() / logged:.0f} ккал / {report.calorie_goal} ккал
+🔥 Сожжено всего: {report.kcal_burned.sum():.0f} ккал
+✅ Дней в пределах нормы калорий: {report.calorie_hit_days}
+⚖ Дефицит: {report.deficit_total:.0f} ккал, профицит: {report.surplus_total:.0f} ккал
+"""
@@ -0,0 +1,393 @@
+import asyncio
+import csv
+import gzip
+import io
+import json
+from collections import Counter
+from datetime import datetime
+
+from db import Database, compacted_before, day_key
+from goals import DEFAULT_TEMPERATURE, goals_for
+
+# Выгрузка и загрузка истории пользователя (/export, /import).
+# Логи читаются пачками по индексу (user_id, day) и сразу пишутся в сжатый
+# файл на диске, загрузка тоже идёт потоково и пачками транзакций, поэтому
+# память не зависит от длины истории. Формат — gzip CSV или gzip JSONL,
+# по строке на запись; поле record говорит, что это за запись.
+
+EXPORT_FORMATS = ("csv", "jsonl")
+CHUNK_SIZE = 500
+
+PROFILE_FIELDS = ("weight", "height", "age", "activity", "city", "calorie_goal", "water_goal")
+
+# запись -> (таблица, колонки)
+LOG_RECORDS = {
+    "water": ("water_logs", ("date", "day", "amount")),
+    "food": ("food_logs", ("date", "day", "food_name", "calories")),
+    "workout": ("workout_logs", ("date", "day", "workout_type", "duration", "calories_burned")),
+}
+# итоги за дни, сырые логи которых уже удалены (см. retention.py)
+TOTAL_FIELDS = ("day", "water_ml", "kcal_in", "kcal_burned")
+
+CSV_FIELDS = ["record"] + list(dict.fromkeys(
+    PROFILE_FIELDS + TOTAL_FIELDS + tuple(field for _, fields in LOG_RECORDS.values() for field in fields)
+))
+
+
+class ImportFormatError(Exception):
+    pass
+
+
+async def _fetch(database: Database, sql: str, params):
+    async with database.read() as db:
+        async with db.execute(sql, params) as cursor:
+            return await cursor.fetchall()
+
+
+# Записи пользователя по порядку; между пачками соединение возвращается в пул
+async def iter_user_records(database: Database, user_id: int):
+    rows = await _fetch(database, f"SELECT {', '.join(PROFILE_FIELDS)} FROM users WHERE user_id = ?", (user_id,))
+    for row in rows:
+        yield {"record": "profile", **dict(zip(PROFILE_FIELDS, row))}
+
+    last_day = -1
+    while True:
+        rows = await _fetch(database, f"""
+            SELECT {', '.join(TOTAL_FIELDS)} FROM daily_totals
+            WHERE user_id = ? AND day > ? AND day < (SELECT compacted_before FROM log_retention)
+            ORDER BY day LIMIT ?
+        """, (user_id, last_day, CHUNK_SIZE))
+        for row in rows:
+            yield {"record": "total", **dict(zip(TOTAL_FIELDS, row))}
+        if len(rows) < CHUNK_SIZE:
+            break
+        last_day = rows[-1][0]
+
+    for record, (table, fields) in LOG_RECORDS.items():
+        last = (-1, 0)
+        while True:
+            # (day, rowid) — порядок индекса (user_id, day), каждая пачка — поиск по индексу
+            rows = await _fetch(database, f"""
+                SELECT day, rowid, {', '.join(fields)} FROM {table}
+                WHERE user_id = ? AND (day, rowid) > (?, ?)
+                ORDER BY day, rowid LIMIT ?
+            """, (user_id, *last, CHUNK_SIZE))
+            for row in rows:
+                yield {"record": record, **dict(zip(fields, row[2:]))}
+            if len(rows) < CHUNK_SIZE:
+                break
+            last = rows[-1][:2]
+
+
+def _encode(records, fmt: str) -> bytes:
+    if fmt == "jsonl":
+        return "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records).encode()
+    buffer = io.StringIO()
+    csv.DictWriter(buffer, CSV_FIELDS, restval="").writerows(records)
+    return buffer.getvalue().encode()
+
+
+async def export_user_data(database: Database, user_id: int, path: str, fmt: str = "csv") -> int:
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+
+    count = 0
+    chunk = []
+    with gzip.open(path, "wb") as out:
+        if fmt == "csv":
+            out.write((",".join(CSV_FIELDS) + "\r\n").encode())
+        async for record in iter_user_records(database, user_id):
+            chunk.append(record)
+            if len(chunk) >= CHUNK_SIZE:
+                # сжатие и запись — в потоке, чтобы не задерживать event loop
+                await asyncio.to_thread(out.write, _encode(chunk, fmt))
+                count += len(chunk)
+                chunk = []
+        if chunk:
+            await asyncio.to_thread(out.write, _encode(chunk, fmt))
+            count += len(chunk)
+    return count
+
+
+def _read_records(path: str):
+    with open(path, "rb") as f:
+        compressed = f.read(2) == b"\x1f\x8b"
+    with (gzip.open(path, "rt", encoding="utf-8-sig") if compressed else open(path, encoding="utf-8-sig")) as f:
+        first = f.readline()
+        if first.lstrip().startswith("{"):
+            yield json.loads(first)
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(f, fieldnames=next(csv.reader([first])))
+
+
+def _number(value, kind=float):
+    if value is None or value == "":
+        return None
+    return kind(float(value))
+
+
+def _day(record):
+    if record.get("day") not in (None, ""):
+        return int(record["day"])
+    return day_key(datetime.strptime(str(record["date"])[:10], "%Y-%m-%d"))
+
+
+# Строка для INSERT или None, если запись не распознана
+def _log_params(user_id: int, record: dict):
+    kind = record.get("record")
+    if kind == "water":
+        return kind, (user_id, record["date"], _day(record), _number(record["amount"], int))
+    if kind == "food":
+        return kind, (user_id, record["date"], _day(record), record["food_name"], _number(record["calories"]))
+    if kind == "workout":
+        return kind, (user_id, record["date"], _day(record), record["workout_type"],
+                      _number(record["duration"], int), _number(record["calories_burned"], int))
+    if kind == "total":
+        return kind, (user_id, _day(record), _number(record["water_ml"], int) or 0,
+                      _number(record["kcal_in"]) or 0, _number(record["kcal_burned"], int) or 0)
+    if kind == "profile":
+        return kind, _profile_row(user_id, record)
+    return None
+
+
+# Профиль: поля из файла и нормы по формулам (при средней погоде) — ими заполняются
+# только нормы, которых нет ни в файле, ни в базе. Если норм в файле нет и посчитать
+# их не из чего — запись отклоняется, чтобы не оставить профиль без норм
+def _profile_row(user_id: int, record: dict):
+    values = [None if record.get(field) == "" else record.get(field) for field in PROFILE_FIELDS]
+    computed = (None, None)
+    if record.get("calorie_goal") in (None, "") or record.get("water_goal") in (None, ""):
+        body = [_number(record.get(field)) for field in ("weight", "height", "age", "activity")]
+        if None in body:
+            raise ValueError("в профиле нет норм и данных для их расчёта")
+        computed = goals_for(*body, DEFAULT_TEMPERATURE)
+    return (user_id, *values, *computed)
+
+
+# Повторная загрузка того же файла ничего не дублирует. Одинаковые строки лога
+# в истории законны (два яблока за день), поэтому строка пропускается, только
+# если таких в базе уже не меньше, чем встретилось в файле до неё включительно
+# (последний параметр — этот номер вхождения).
+def _insert_log_sql(table: str, fields) -> str:
+    columns = ("user_id",) + fields
+    params = ", ".join(f"?{i}" for i in range(1, len(columns) + 1))
+    match = " AND ".join(f"{column} IS ?{i}" for i, column in enumerate(columns, start=1))
+    return f"""
+        INSERT INTO {table} ({', '.join(columns)}) SELECT {params}
+        WHERE (SELECT COUNT(*) FROM {table} WHERE {match}) < ?{len(columns) + 1}
+    """
+
+
+# Пустые поля файла не затирают то, что уже есть в профиле; параметры — ?1 user_id,
+# затем PROFILE_FIELDS, затем рассчитанные calorie_goal и water_goal
+def _profile_sql() -> str:
+    computed = {"calorie_goal": len(PROFILE_FIELDS) + 2, "water_goal": len(PROFILE_FIELDS) + 3}
+    values, updates = [], []
+    for i, field in enumerate(PROFILE_FIELDS, start=2):
+        if field in computed:
+            values.append(f"COALESCE(?{i}, ?{computed[field]})")
+            updates.append(f"{field} = COALESCE(?{i}, {field}, ?{computed[field]})")
+        else:
+            values.append(f"?{i}")
+            updates.append(f"{field} = COALESCE(?{i}, {field})")
+    return f"""
+        INSERT INTO users (user_id, {', '.join(PROFILE_FIELDS)}) VALUES (?1, {', '.join(values)})
+        ON CONFLICT (user_id) DO UPDATE SET {', '.join(updates)}
+    """
+
+
+INSERT_SQL = {
+    **{record: _insert_log_sql(table, fields) for record, (table, fields) in LOG_RECORDS.items()},
+    # итоги без сырых логов только создают недостающие дни, уже посчитанные не трогают
+    "total": """
+        INSERT INTO daily_totals (user_id, day, water_ml, kcal_in, kcal_burned) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (user_id, day) DO NOTHING
+    """,
+    # сырые логи за уже компактифицированные дни сразу сворачиваются в итоги:
+    # в таблицы логов за эти дни не пишем (их удалила бы следующая компактификация)
+    "fold": """
+        INSERT INTO daily_totals (user_id, day, water_ml, kcal_in, kcal_burned) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (user_id, day) DO UPDATE SET
+            water_ml = water_ml + excluded.water_ml,
+            kcal_in = kcal_in + excluded.kcal_in,
+            kcal_burned = kcal_burned + excluded.kcal_burned
+    """,
+    "profile": _profile_sql(),
+}
+
+
+# Лог за компактифицированный день -> строка для INSERT_SQL["fold"]
+def _fold_params(kind: str, row):
+    user_id, day = row[0], row[2]
+    if kind == "water":
+        return user_id, day, row[3] or 0, 0, 0
+    if kind == "food":
+        return user_id, day, 0, row[4] or 0, 0
+    return user_id, day, 0, 0, row[5] or 0
+
+
+# Записи добавляются к истории пользователя user_id (чужой user_id в файле не важен).
+# Каждая пачка — отдельная транзакция; итоги по дням обновляют триггеры daily_totals.
+# В counts — сколько записей реально добавлено, уже имевшиеся не считаются.
+# Дни раньше log_retention.compacted_before окончательны: если итог за такой день
+# уже был до загрузки, записи за него пропускаются, иначе день собирается в daily_totals.
+async def import_user_data(database: Database, user_id: int, path: str, batch_size: int = CHUNK_SIZE):
+    counts = dict.fromkeys(("water", "food", "workout", "total", "profile"), 0)
+    skipped = 0
+    batch = []  # (ключ INSERT_SQL, запись для counts, параметры)
+    # номера вхождений одинаковых строк; выгрузка идёт по дням, поэтому
+    # счётчик сбрасывается на новом дне и память не растёт с историей
+    seen = Counter()
+    seen_day = None
+
+    async with database.read() as db:
+        compacted = await compacted_before(db)
+        async with db.execute(
+            "SELECT day FROM daily_totals WHERE user_id = ? AND day < ?", (user_id, compacted)
+        ) as cursor:
+            final_days = {day for (day,) in await cursor.fetchall()}
+
+    async def flush():
+        grouped = {}
+        for sql_kind, kind, params in batch:
+            grouped.setdefault((sql_kind, kind), []).append(params)
+        async with database.write() as db:
+            for (sql_kind, kind), rows in grouped.items():
+                cursor = await db.executemany(INSERT_SQL[sql_kind], rows)
+                counts[kind] += cursor.rowcount
+        batch.clear()
+
+    records = _read_records(path)
+    while True:
+        # разбор файла — в потоке, по пачке за раз
+        chunk = await asyncio.to_thread(_next_chunk, records, batch_size)
+        if chunk is None:
+            raise ImportFormatError(f"файл повреждён или не похож на выгрузку /export (загружено записей: {sum(counts.values())})")
+        if not chunk:
+            break
+        for record in chunk:
+            try:
+                params = _log_params(user_id, record)
+            except (KeyError, TypeError, ValueError):
+                params = None
+            if params is None:
+                skipped += 1
+                continue
+            kind, row = params
+            if kind == "total" and row[1] in final_days:
+                continue
+            if kind in LOG_RECORDS:
+                if row[2] < compacted:
+                    if row[2] not in final_days:
+                        batch.append(("fold", kind, _fold_params(kind, row)))
+                    continue
+                if (kind, row[2]) != seen_day:
+                    seen.clear()
+                    seen_day = (kind, row[2])
+                seen[row] += 1
+                row = row + (seen[row],)
+            batch.append((kind, kind, row))
+        if batch:
+            await flush()
+
+    return counts, skipped
+
+
+def _next_chunk(records, size: int):
+    chunk = []
+    try:
+        for record in records:
+            chunk.append(record if isinstance(record, dict) else {})
+            if len(chunk) >= size:
+                break
+    except (OSError, EOFError, UnicodeDecodeError, json.JSONDecodeError, csv.Error):
+        return None
+    return chunk
+
+
+# Проверка идемпотентности: python user_data.py check-roundtrip
+# Выгрузка и повторная загрузка тому же пользователю не должны менять ни логи, ни итоги —
+# в том числе если между выгрузкой и загрузкой прошла компактификация логов.
+# Загрузка новому пользователю должна дать те же итоги по дням.
+async def _check_roundtrip(fmt: str):
+    import datetime as dt
+    import os
+    import tempfile
+
+    from db import migrate
+    from retention import compact_logs
+
+    async def totals(database, user_id):
+        return await _fetch(database, "SELECT day, water_ml, kcal_in, kcal_burned FROM daily_totals WHERE user_id = ? ORDER BY day", (user_id,))
+
+    async def snapshot(database, user_id):
+        return [await totals(database, user_id)] + [
+            await _fetch(database, f"SELECT COUNT(*) FROM {table} WHERE user_id = ?", (user_id,))
+            for table, _ in LOG_RECORDS.values()
+        ]
+
+    async def reimport(database, user_id, path, what):
+        before = await snapshot(database, user_id)
+        counts, skipped = await import_user_data(database, user_id, path)
+        after = await snapshot(database, user_id)
+        if after != before or skipped or any(counts[kind] for kind in (*LOG_RECORDS, "total")):
+            raise SystemExit(f"{fmt}: {what} изменила историю: {counts}, {before} -> {after}")
+
+    async def same_totals(database, user_id, what):
+        if await totals(database, user_id) != await totals(database, 1):
+            raise SystemExit(f"{fmt}: {what}: итоги по дням не совпали с исходными")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = Database(os.path.join(tmp, "roundtrip.db"), readers=1)
+        await database.open()
+        try:
+            async with database.write() as db:
+                await migrate(db)
+                await db.execute("INSERT INTO users (user_id, weight, calorie_goal, water_goal) VALUES (1, 70, 2000, 2100)")
+                await db.execute("UPDATE log_retention SET compacted_before = 20240102")
+                await db.execute("INSERT INTO daily_totals VALUES (1, 20240101, 1500, 1800, 200)")
+                for day in (2, 3):
+                    date = f"2024-01-0{day}"
+                    await db.executemany(
+                        "INSERT INTO water_logs (user_id, date, day, amount) VALUES (1, ?, ?, 250)",
+                        [(f"{date} 09:00:00", 20240100 + day), (f"{date} 12:00:00", 20240100 + day)],
+                    )
+                    # одинаковые строки за день — законные, их не должно схлопнуть
+                    await db.executemany(
+                        "INSERT INTO food_logs (user_id, date, day, food_name, calories) VALUES (1, ?, ?, 'яблоко', 52.5)",
+                        [(date, 20240100 + day)] * 2,
+                    )
+                    await db.execute(
+                        "INSERT INTO workout_logs (user_id, date, day, workout_type, duration, calories_burned) "
+                        "VALUES (1, ?, ?, 'бег', 30, 300)", (date, 20240100 + day),
+                    )
+            path = os.path.join(tmp, f"export.{fmt}.gz")
+            await export_user_data(database, 1, path, fmt)
+            for attempt in (1, 2):
+                await reimport(database, 1, path, f"повторная загрузка №{attempt}")
+            await import_user_data(database, 2, path)
+            await same_totals(database, 2, "загрузка новому пользователю")
+            await reimport(database, 2, path, "повторная загрузка новому пользователю")
+
+            # логи за 2 января компактифицируются, в выгрузке они остались сырыми
+            await compact_logs(database, 0, dt.date(2024, 1, 3), pause=0)
+            await reimport(database, 1, path, "загрузка после компактификации")
+            await import_user_data(database, 3, path)
+            await same_totals(database, 3, "загрузка новому пользователю после компактификации")
+            await reimport(database, 3, path, "повторная загрузка после компактификации")
+        finally:
+            await database.close()
+    print(f"{fmt}: выгрузка и повторная загрузка историю не меняют")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Проверки выгрузки/загрузки истории")
+    parser.add_argument("command", choices=["check-roundtrip"])
+    args = parser.parse_args()
+    for fmt in EXPORT_FORMATS:
+        asyncio.run(_check_roundtrip(fmt))
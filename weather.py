@@ -0,0 +1,57 @@
+import asyncio
+import logging
+import time
+
+# Кэш температуры по городам.
+# - ключ — нормализованное название города;
+# - удачный ответ хранится ttl секунд, неудачный (None) — negative_ttl секунд,
+#   чтобы при недоступности API не долбить его повторными запросами;
+# - одновременные запросы одного города ждут один общий запрос к API.
+
+
+def normalize_city(city: str) -> str:
+    return " ".join(city.split()).casefold().replace("ё", "е")
+
+
+class WeatherCache:
+    def __init__(self, fetch, ttl: float = 1800, negative_ttl: float = 60, max_entries: int = 10000):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._entries = {}  # city -> (expires_at, temp)
+        self._in_flight = {}  # city -> Future
+
+    async def get(self, city: str):
+        key = normalize_city(city)
+        entry = self._entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+
+        future = self._in_flight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._load(key, city))
+            self._in_flight[key] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        # shield: отмена одного ожидающего не отменяет общий запрос для остальных
+        return await asyncio.shield(future)
+
+    async def _load(self, key: str, city: str):
+        try:
+            temp = await self.fetch(city)
+        except Exception:
+            logging.exception("Не удалось получить погоду для %s", city)
+            temp = None
+
+        ttl = self.ttl if temp is not None else self.negative_ttl
+        self._entries.pop(key, None)
+        self._entries[key] = (time.monotonic() + ttl, temp)
+        while len(self._entries) > self.max_entries:
+            del self._entries[next(iter(self._entries))]
+        return temp
+
+    def invalidate(self, city: str = None):
+        if city is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(normalize_city(city), None)
@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import signal
+
+from aiohttp import web
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+from metrics import REGISTRY
+
+# Режим webhook: Telegram сам присылает обновления POST-запросами на наш aiohttp-сервер.
+# Обновление обрабатывается внутри запроса, поэтому при остановке /health сначала
+# отвечает 503 (drain_grace секунд, чтобы балансировщик успел снять экземпляр),
+# затем сервер перестаёт принимать соединения и ждёт (до drain_timeout), пока допишутся начатые.
+
+
+async def health(request: web.Request):
+    if request.app["draining"].is_set():
+        return web.json_response({"status": "draining"}, status=503)
+    return web.json_response({"status": "ok"})
+
+
+async def metrics(request: web.Request):
+    return web.Response(
+        body=REGISTRY.render().encode(),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+
+def create_app(dp, bot, path: str, secret: str):
+    app = web.Application()
+    # событие, а не флаг: запущенное приложение aiohttp не даёт менять свои ключи
+    app["draining"] = asyncio.Event()
+    app.router.add_get("/health", health)
+    # /metrics здесь нет: webhook-сервер смотрит наружу, метрики отдаёт run_metrics_server
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret, handle_in_background=False).register(app, path=path)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+# /metrics (и /health) отдаёт отдельный маленький сервер на своём адресе — в обоих режимах
+async def run_metrics_server(host: str, port: int):
+    app = web.Application()
+    app["draining"] = asyncio.Event()
+    app.router.add_get("/health", health)
+    app.router.add_get("/metrics", metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except OSError:
+        await runner.cleanup()
+        raise
+    logging.info("Метрики доступны на %s:%d/metrics", host, port)
+    return runner
+
+
+async def run_webhook(dp, bot, url: str, path: str, secret: str, host: str, port: int,
+                      drain_timeout: float = 30, drain_grace: float = 5):
+    app = create_app(dp, bot, path, secret)
+    runner = web.AppRunner(app, shutdown_timeout=drain_timeout)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    try:
+        await bot.set_webhook(
+            url.rstrip("/") + path,
+            secret_token=secret,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+        logging.info("Webhook запущен на %s:%d%s", host, port, path)
+        await stop.wait()
+    finally:
+        # webhook у Telegram не снимаем: за балансировщиком могут работать другие экземпляры
+        app["draining"].set()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(sig)
+        if stop.is_set():
+            logging.info("Остановка webhook-сервера: /health отвечает 503, ждём %.0f с", drain_grace)
+            await asyncio.sleep(drain_grace)
+        logging.info("Остановка webhook-сервера, ждём обработки начатых обновлений")
+        await runner.cleanup()
+        # как и при polling: обработчики могли заново открыть сессию уже после on_shutdown
+        await bot.session.close()